@@ -1,14 +1,23 @@
 # LMSProject/asgi.py
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import chat.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "LMSProject.settings")
 
+# Set up Django (app registry) before anything that imports models
 django_asgi_app = get_asgi_application()
 
+from django.conf import settings  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import chat.routing  # noqa: E402
+
+if getattr(settings, "ASSISTANT_WARMUP", True):
+    # Load spaCy/tokenizer/embedding model and hot course indexes before the
+    # first assistant request; progress is reported at /assistant/health/
+    from assistant import warmup
+    warmup.start()
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
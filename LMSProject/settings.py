@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,9 +50,38 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = "LMSProject.asgi.application"  # adjust to your project name
 
-CHANNEL_LAYERS = {
-    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
-}
+# Set CHAT_REDIS_URL (e.g. redis://redis:6379/0, or unix:///tmp/lms-chat.sock for
+# `manage.py run_chat_broker`) to fan chat out across processes and nodes.
+CHAT_REDIS_URL = os.environ.get("CHAT_REDIS_URL", "")
+
+if CHAT_REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.BatchingRedisPubSubChannelLayer",
+            "CONFIG": {
+                "hosts": [CHAT_REDIS_URL],
+                "prefix": "lms",
+                # Publishes within this many seconds share one pipeline round trip
+                "batch_window": float(os.environ.get("CHAT_PUBLISH_BATCH_WINDOW", "0.002")),
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+    }
+
+# Chat messages are broadcast immediately and written in batches every
+# CHAT_WRITE_BEHIND_MS ms or CHAT_WRITE_BEHIND_MAX messages (chat.writebehind).
+# 0 writes each message before broadcasting it.
+CHAT_WRITE_BEHIND_MS = int(os.environ.get("CHAT_WRITE_BEHIND_MS", "50"))
+CHAT_WRITE_BEHIND_MAX = 200
+
+# Per-process cache of each user's course roles used by the chat ACL
+# (chat.acl). Enrollment/TA/profile signals invalidate it in every process that
+# has opened a chat socket (channel-layer group "chat_acl"); the TTL bounds
+# staleness everywhere else.
+CHAT_ACL_CACHE_TTL = 60     # seconds
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -151,6 +181,72 @@ AI_DB_DIR.mkdir(parents=True, exist_ok=True)
 OLLAMA_LLM_MODEL = "llama3"
 OLLAMA_EMBED_MODEL = "nomic-embed-text"
 
+# PDF text extraction: >1 splits the page range across a process pool
+ASSISTANT_PDF_WORKERS = 4
+ASSISTANT_PDF_PAGES_PER_TASK = 16
+
+# spaCy entity extraction during indexing (nlp.pipe batching)
+ASSISTANT_NER_BATCH_SIZE = 64
+ASSISTANT_NER_PROCESSES = 1          # >1 forks spaCy worker processes
+
+# Streaming ingestion: items buffered between stages, chunks per Chroma flush
+ASSISTANT_STREAM_QUEUE_SIZE = 256
+ASSISTANT_EMBED_BATCH_SIZE = 64
+
+# On-disk embedding cache shared by ingestion and queries (LRU-capped)
+ASSISTANT_EMBED_CACHE_PATH = Path(os.environ.get(
+    "ASSISTANT_EMBED_CACHE_PATH",
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "lms" / "embedding_cache.sqlite3",
+))
+ASSISTANT_EMBED_CACHE_MAX_ENTRIES = 200_000
+
+# Open per-course Chroma handles are reused across requests, closed after this idle time
+ASSISTANT_STORE_IDLE_SECONDS = 900
+
+# Assistant answer cache (per process); keyed by course index version
+ASSISTANT_ANSWER_CACHE_SIZE = 1024
+ASSISTANT_ANSWER_CACHE_TTL = 3600    # seconds
+ASSISTANT_ANSWER_SIMILARITY = 0.95   # cosine threshold for near-duplicate questions; 0 disables
+
+# Threads used by the async assistant views for spaCy query parsing
+ASSISTANT_NLP_THREADS = 2
+
+# Knowledge-graph query expansion
+ASSISTANT_KG_MAX_NEIGHBORS = 8       # strongest co-occurring entities kept per entity
+ASSISTANT_KG_BUDGET_MS = 5           # per-request time budget for expansion + candidate lookup
+
+# Retrieval reranker (cross-encoder over the MAX_FETCH candidates, CPU). Off by default
+# because "assistant.rerank.CrossEncoderReranker" downloads ASSISTANT_RERANK_MODEL from
+# the Hugging Face Hub unless it is already cached (sentence-transformers itself is in
+# requirements.txt); set it once the model is available offline or the Hub is reachable.
+ASSISTANT_RERANKER = os.environ.get("ASSISTANT_RERANKER", "")   # "" = combined_rank_score only
+ASSISTANT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+ASSISTANT_RERANK_BATCH_SIZE = 16
+ASSISTANT_RERANK_BUDGET_MS = 300     # past this, unscored candidates keep combined_rank_score order
+ASSISTANT_RERANK_CONCURRENCY = 2     # forward passes run at once per process
+ASSISTANT_RERANK_CONTEXT_K = 6       # max chunks sent to the LLM when the reranker ran
+
+# Context selection: relevance vs. redundancy trade-off for MMR (1.0 = relevance only)
+ASSISTANT_MMR_LAMBDA = 0.7
+
+# Tokenizer used for context budgeting: Ollama model -> Hugging Face tokenizer repo
+# (extends assistant.tokens.DEFAULT_TOKENIZERS)
+ASSISTANT_TOKENIZERS = {}
+
+# Startup warm-up (LMSProject/asgi.py): shared spaCy model, tokenizer, reranker, one
+# embedding call, and the vector/BM25/KG indexes of the most enrolled courses
+ASSISTANT_SPACY_MODEL = "en_core_web_sm"
+ASSISTANT_WARMUP = os.environ.get("ASSISTANT_WARMUP", "1") != "0"   # ASSISTANT_WARMUP=0 for web/chat-only workers
+ASSISTANT_WARMUP_COURSES = 3         # 0 = don't pre-open any course store
+
+# Material indexing queue (see `manage.py run_index_workers`)
+ASSISTANT_INDEX_WORKERS = 2          # worker threads per run_index_workers process
+ASSISTANT_INDEX_MAX_RUNNING = 2      # jobs allowed to run at once across all workers
+ASSISTANT_INDEX_MAX_ATTEMPTS = 5
+ASSISTANT_INDEX_RETRY_BASE = 30      # seconds; doubled on every failed attempt
+ASSISTANT_INDEX_RETRY_MAX = 3600
+ASSISTANT_INDEX_JOB_TIMEOUT = 1800   # RUNNING longer than this is treated as a dead worker
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
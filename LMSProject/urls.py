@@ -31,6 +31,7 @@ urlpatterns = [
     path('', main.home, name='home'),
     path('courses/<int:course_id>/', main.course, name='course'),
     path("courses/<int:course_id>/chat/", chat.course_chat, name="course_chat"),
+    path("courses/<int:course_id>/chat/history/", chat.course_chat_history, name="course_chat_history"),
     path("rooms/<int:room_id>/unread-summary/", chat.unread_summary, name="unread_summary"),
 
     path('courses/new/', courses.course_create, name='course_create'),
@@ -54,7 +55,9 @@ urlpatterns = [
     path("exams/<int:course_id>/register/", exams.exam_register_choose, name="exam_register_choose"),
 
     path("assistant/response/", assistant.response, name="assistant_response"),
+    path("assistant/response/stream/", assistant.response_stream, name="assistant_response_stream"),
     path("assistant/chat/", assistant.chat_page, name="assistant_chat_page"),
+    path("assistant/health/", assistant.health, name="assistant_health"),
 ]
 
 if settings.DEBUG:
@@ -1,3 +1,9 @@
 from django.contrib import admin
+from assistant.models import IndexingJob
 
 # Register your models here.
+@admin.register(IndexingJob)
+class IndexingJobAdmin(admin.ModelAdmin):
+    list_display = ("action", "material", "status", "attempts", "run_after", "started_at", "duration_ms", "worker")
+    list_filter = ("status", "action")
+    readonly_fields = ("created_at", "started_at", "finished_at", "duration_ms", "last_error")
@@ -0,0 +1,96 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+_SPACE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n?!.,;:\"'"
+
+def normalize_question(q: str) -> str:
+    return _SPACE.sub(" ", q.strip().lower()).strip(_EDGE_PUNCT)
+
+
+class AnswerCache:
+    """Per-process cache of assistant answers with TTL and LRU eviction.
+
+    Keys include the course's index version, so new material invalidates old
+    answers automatically. With a query vector, a miss on the exact question
+    falls back to the most similar cached question of the same course/version
+    if its cosine similarity is at least `threshold`.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # key -> (payload, unit query vector or None, expires at)
+        self._entries: "OrderedDict[Tuple, Tuple[Dict[str, Any], Optional[np.ndarray], float]]" = OrderedDict()
+
+    @staticmethod
+    def _key(course_id, version: int, question: str, k) -> Tuple:
+        return (str(course_id), version, k, normalize_question(question))
+
+    @staticmethod
+    def _unit(vec: Optional[List[float]]) -> Optional[np.ndarray]:
+        if vec is None:
+            return None
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else None
+
+    def get(self, course_id, version: int, question: str, k=None, vec: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        key = self._key(course_id, version, question, k)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+            if vec is None or self.threshold <= 0:
+                return None
+            q = self._unit(vec)
+            if q is None:
+                return None
+            best_key, best_sim = None, self.threshold
+            for other, (_payload, v, expires) in self._entries.items():
+                if other[:3] != key[:3] or v is None or expires <= now:
+                    continue
+                sim = float(np.dot(q, v))
+                if sim >= best_sim:
+                    best_key, best_sim = other, sim
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][0]
+
+    def put(self, course_id, version: int, question: str, payload: Dict[str, Any], k=None, vec: Optional[List[float]] = None) -> None:
+        key = self._key(course_id, version, question, k)
+        with self._lock:
+            self._entries[key] = (payload, self._unit(vec), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_CACHE: Optional[AnswerCache] = None
+
+def answer_cache() -> AnswerCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = AnswerCache(
+            max_entries=int(getattr(settings, "ASSISTANT_ANSWER_CACHE_SIZE", 1024)),
+            ttl=float(getattr(settings, "ASSISTANT_ANSWER_CACHE_TTL", 3600)),
+            threshold=float(getattr(settings, "ASSISTANT_ANSWER_SIMILARITY", 0.95)),
+        )
+    return _CACHE
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model, kind, sha256(text)).
+
+    Vectors are stored as packed float32 blobs in a small SQLite file (WAL, so
+    several worker processes can share it). Entries are evicted least recently
+    used first once `max_entries` is exceeded. Reads only record their
+    last-used time in memory; it is written with the next put_many() or every
+    `touch_interval` seconds, so a lookup is not a write.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 200_000, touch_interval: float = 60.0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        # key -> last used, not yet written
+        self._touched: Dict[str, float] = {}
+        self._touch_flushed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._count: Optional[int] = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embedding_last_used ON embedding(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, kind: str, text: str) -> str:
+        return f"{model}:{kind}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embedding WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for k, blob in rows:
+                    found[k] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if time.monotonic() - self._touch_flushed >= self.touch_interval:
+                    self._flush_touches()
+                    self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            # Eviction below orders by last_used, so record pending reads first
+            self._flush_touches()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding(key, vec, last_used) VALUES (?, ?, ?)",
+                [(k, array("f", v).tobytes(), now) for k, v in items.items()],
+            )
+            if self._count is None:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+            else:
+                self._count += len(items)
+            if self._count > self.max_entries:
+                # Trim to 90% so eviction is amortized over many inserts
+                drop = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embedding WHERE key IN "
+                    "(SELECT key FROM embedding ORDER BY last_used LIMIT ?)", (drop,)
+                )
+                self._count = None
+            self._conn.commit()
+
+    def _flush_touches(self) -> None:
+        # Caller holds self._lock and commits
+        if self._touched:
+            self._conn.executemany("UPDATE embedding SET last_used=? WHERE key=?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        self._touch_flushed = time.monotonic()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model."""
+
+    def __init__(self, inner: Embeddings, model: str, cache: EmbeddingCache):
+        self.inner = inner
+        self.model = model
+        self.cache = cache
+
+    def _embed(self, texts: List[str], kind: str, compute) -> List[List[float]]:
+        keys = [EmbeddingCache.key(self.model, kind, t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+        if missing:
+            vectors = compute(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "doc", self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query", lambda ts: [self.inner.embed_query(ts[0])])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = EmbeddingCache.key(self.model, "query", text)
+        # SQLite may wait on another process's write lock; keep it off the event loop
+        found = await sync_to_async(self.cache.get_many, thread_sensitive=False)([key])
+        if key in found:
+            return found[key]
+        if isinstance(self.inner, OllamaEmbeddings):
+            vec = await _ollama_aembed(self.inner, f"{self.inner.query_instruction}{text}")
+        else:
+            vec = await self.inner.aembed_query(text)
+        await sync_to_async(self.cache.put_many, thread_sensitive=False)({key: vec})
+        return vec
+
+
+# OllamaEmbeddings fields sent as "options" (what its sync request sends)
+_OLLAMA_OPTIONS = (
+    "mirostat", "mirostat_eta", "mirostat_tau", "num_ctx", "num_gpu", "num_thread",
+    "repeat_last_n", "repeat_penalty", "temperature", "stop", "tfs_z", "top_k", "top_p",
+)
+
+# One HTTP session (connection pool) per event loop
+_SESSIONS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+def _session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = _SESSIONS[loop] = aiohttp.ClientSession()
+    return session
+
+async def _ollama_aembed(client: OllamaEmbeddings, prompt: str) -> List[float]:
+    """Non-blocking twin of OllamaEmbeddings.embed_query (same payload, same vector)."""
+    headers = {"Content-Type": "application/json", **(client.headers or {})}
+    payload = {
+        "model": client.model,
+        "prompt": prompt,
+        "options": {name: getattr(client, name) for name in _OLLAMA_OPTIONS},
+    }
+    async with _session().post(f"{client.base_url}/api/embeddings", headers=headers, json=payload) as res:
+        if res.status != 200:
+            raise ValueError(f"Error raised by inference API HTTP code: {res.status}, {await res.text()}")
+        return (await res.json())["embedding"]
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_LOCK = threading.Lock()
+
+def embedding_cache() -> EmbeddingCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                path = getattr(settings, "ASSISTANT_EMBED_CACHE_PATH", Path(settings.AI_DB_DIR).parent / "embedding_cache.sqlite3")
+                _CACHE = EmbeddingCache(path, int(getattr(settings, "ASSISTANT_EMBED_CACHE_MAX_ENTRIES", 200_000)))
+    return _CACHE
+
+def get_embeddings() -> Embeddings:
+    """Embedding function shared by ingestion and query paths."""
+    model = getattr(settings, "OLLAMA_EMBED_MODEL", "nomic-embed-text")
+    return CachedEmbeddings(OllamaEmbeddings(model=model), model, embedding_cache())
@@ -0,0 +1,122 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, F, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import IndexingJob
+
+logger = logging.getLogger(__name__)
+
+
+def _max_running() -> int:
+    return int(getattr(settings, "ASSISTANT_INDEX_MAX_RUNNING", 2))
+
+def _retry_delay(attempts: int) -> timedelta:
+    # Exponential backoff: base, 2*base, 4*base ... capped
+    base = int(getattr(settings, "ASSISTANT_INDEX_RETRY_BASE", 30))
+    cap = int(getattr(settings, "ASSISTANT_INDEX_RETRY_MAX", 3600))
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_material(material) -> IndexingJob:
+    """Queue a material for indexing; reuses an already pending job for it."""
+    job = IndexingJob.objects.filter(material=material, status=IndexingJob.PENDING).first()
+    if job:
+        return job
+    return IndexingJob.objects.create(
+        material=material,
+        max_attempts=int(getattr(settings, "ASSISTANT_INDEX_MAX_ATTEMPTS", 5)),
+    )
+
+def enqueue_removal(course_id: int, material_id: int) -> IndexingJob:
+    """Queue dropping a deleted material's vectors, KG contribution and index files."""
+    return IndexingJob.objects.create(
+        action=IndexingJob.REMOVE,
+        course_id=course_id,
+        removed_material_id=material_id,
+        max_attempts=int(getattr(settings, "ASSISTANT_INDEX_MAX_ATTEMPTS", 5)),
+    )
+
+def requeue_stale(timeout_seconds: Optional[int] = None) -> int:
+    """Put RUNNING jobs whose worker died (no finish within timeout) back in the queue.
+
+    The attempt was counted when the job was claimed, so a job that keeps killing
+    its worker (OOM, segfault) ends up FAILED instead of being retried forever.
+    """
+    timeout_seconds = timeout_seconds or int(getattr(settings, "ASSISTANT_INDEX_JOB_TIMEOUT", 1800))
+    now = timezone.now()
+    stale = IndexingJob.objects.filter(status=IndexingJob.RUNNING, started_at__lt=now - timedelta(seconds=timeout_seconds))
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=IndexingJob.FAILED, worker="", finished_at=now, last_error="Worker died while running the job",
+    )
+    return failed + stale.update(status=IndexingJob.PENDING, worker="", run_after=now)
+
+def claim_next(worker: str) -> Optional[IndexingJob]:
+    """Atomically take the oldest due job, respecting the global running limit.
+
+    The status compare-and-swap and the running-limit check are one conditional
+    UPDATE, so concurrent workers can neither run the same job nor exceed the
+    limit (SQLite holds the write lock for the whole statement). The attempt is
+    counted here, before the job runs.
+    """
+    running = (IndexingJob.objects.filter(status=IndexingJob.RUNNING)
+               .order_by().values("status").annotate(n=Count("id")).values("n"))
+    due = (IndexingJob.objects
+           .filter(status=IndexingJob.PENDING, run_after__lte=timezone.now())
+           .order_by("run_after", "id")
+           .values_list("id", flat=True)[:5])
+    for job_id in due:
+        claimed = (IndexingJob.objects
+                   .filter(pk=job_id, status=IndexingJob.PENDING)
+                   .alias(running=Coalesce(Subquery(running), 0))
+                   .filter(running__lt=_max_running())
+                   .update(status=IndexingJob.RUNNING, worker=worker, attempts=F("attempts") + 1,
+                           started_at=timezone.now(), finished_at=None))
+        if claimed:
+            return IndexingJob.objects.select_related("material", "material__course").get(pk=job_id)
+    return None
+
+def run_job(job: IndexingJob) -> None:
+    from .pipeline import process_material, remove_material
+
+    started = job.started_at or timezone.now()
+    removing = job.action == IndexingJob.REMOVE
+    material_id = job.removed_material_id if removing else job.material_id
+    try:
+        if removing:
+            remove_material(job.course_id, job.removed_material_id)
+        else:
+            process_material(job.material)
+    except Exception as e:
+        logger.exception("%s failed for material %s (attempt %s): %s",
+                         "Removal" if removing else "Indexing", material_id, job.attempts, e)
+        job.last_error = f"{type(e).__name__}: {e}"
+        if job.attempts >= job.max_attempts:
+            job.status = IndexingJob.FAILED
+        else:
+            job.status = IndexingJob.PENDING
+            job.run_after = timezone.now() + _retry_delay(job.attempts)
+    else:
+        if removing:
+            logger.info("Removed indexes of material %s", material_id)
+        else:
+            logger.info("Indexed material %s (id=%s)", job.material.title, material_id)
+        job.status = IndexingJob.DONE
+        job.last_error = ""
+    job.finished_at = timezone.now()
+    job.duration_ms = int((job.finished_at - started).total_seconds() * 1000)
+    # update(), not save(): the row is gone if the material was deleted meanwhile (CASCADE)
+    IndexingJob.objects.filter(pk=job.pk).update(
+        status=job.status, run_after=job.run_after, last_error=job.last_error,
+        finished_at=job.finished_at, duration_ms=job.duration_ms,
+    )
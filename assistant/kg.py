@@ -0,0 +1,431 @@
+import fcntl
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from .lexical import pack_strings, unpack_strings
+from .postings import EntityIndex, StringTable, encode_strings, write_entity_index
+from .stores import course_dir, index_version
+
+logger = logging.getLogger(__name__)
+
+# A material's contribution: (sorted lowercased entities, u, v, weight) with u < v
+Edges = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+def _no_strings() -> np.ndarray:
+    return np.array([], dtype=str)
+
+def graph_edges(G: nx.Graph) -> Edges:
+    """Upper-triangle edge list of a material graph; case variants of an entity are merged."""
+    pairs = [(str(a).lower(), str(b).lower(), int(d.get("weight", 1))) for a, b, d in G.edges(data=True)]
+    pairs = [p for p in pairs if p[0] != p[1]]
+    if not pairs:
+        empty = np.zeros(0, dtype=np.int32)
+        return _no_strings(), empty, empty, empty
+    strings = np.unique(np.array([s for a, b, _ in pairs for s in (a, b)], dtype=str))
+    u = np.searchsorted(strings, np.array([a for a, _, _ in pairs], dtype=str))
+    v = np.searchsorted(strings, np.array([b for _, b, _ in pairs], dtype=str))
+    w = np.array([c for _, _, c in pairs], dtype=np.int64)
+    n = len(strings)
+    m = sparse.coo_matrix((w, (np.minimum(u, v), np.maximum(u, v))), shape=(n, n)).tocsr().tocoo()
+    return strings, m.row.astype(np.int32), m.col.astype(np.int32), m.data.astype(np.int32)
+
+class CooccurrenceBuilder:
+    """Accumulates entity co-occurrence per chunk on integer entity IDs.
+
+    Chunks are rows of a sparse chunk x entity incidence matrix A (entity IDs
+    are lowercased names); every `block` chunks the pair counts of that block
+    come from one product A.T @ A, upper triangle only. For u != v this equals
+    the number of (i < j) pairs a per-chunk double loop would count.
+    """
+
+    def __init__(self, block: int = 4096):
+        self.block = block
+        self.ids: Dict[str, int] = {}
+        self.index: Dict[str, List] = {}
+        self._rows: List[int] = []
+        self._cols: List[int] = []
+        self._pending = 0
+        self._counts: Optional[sparse.csr_matrix] = None
+
+    def add(self, chunk_key, ents: List[str]) -> None:
+        row = self._pending
+        for e in ents:
+            self.index.setdefault(e, []).append(chunk_key)
+            self._rows.append(row)
+            self._cols.append(self.ids.setdefault(e.lower(), len(self.ids)))
+        self._pending += 1
+        if self._pending >= self.block:
+            self._flush()
+
+    def _flush(self) -> None:
+        n = len(self.ids)
+        if self._rows:
+            rows = np.asarray(self._rows, dtype=np.int32)
+            cols = np.asarray(self._cols, dtype=np.int32)
+            A = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(self._pending, n))
+            block = sparse.triu(A.T @ A, k=1).tocsr()
+            # Fold into the running total so memory follows distinct pairs, not chunks
+            if self._counts is not None:
+                prev = self._counts.tocoo()
+                block = block + sparse.csr_matrix((prev.data, (prev.row, prev.col)), shape=(n, n))
+            self._counts = block
+        self._rows, self._cols, self._pending = [], [], 0
+
+    def edges(self) -> Edges:
+        self._flush()
+        if self._counts is None or not self._counts.nnz:
+            empty = np.zeros(0, dtype=np.int32)
+            return _no_strings(), empty, empty, empty
+        n = len(self.ids)
+        c = self._counts.tocoo()
+        c = sparse.coo_matrix((c.data, (c.row, c.col)), shape=(n, n))
+        # Renumber so the string table is sorted, as _merge expects
+        names = np.array(list(self.ids), dtype=str)
+        order = np.argsort(names)
+        rank = np.empty(n, dtype=np.int32)
+        rank[order] = np.arange(n, dtype=np.int32)
+        ru, rv = rank[c.row], rank[c.col]
+        m = sparse.coo_matrix((c.data, (np.minimum(ru, rv), np.maximum(ru, rv))), shape=(n, n)).tocsr()
+        # Only entities that have an edge go into the table
+        nz_rows, nz_cols = m.nonzero()
+        used = np.unique(np.concatenate([nz_rows, nz_cols]))
+        m = m[used][:, used].tocoo()
+        return names[order][used], m.row.astype(np.int32), m.col.astype(np.int32), m.data.astype(np.int32)
+
+    def graph(self) -> nx.Graph:
+        """The same co-occurrence counts as a networkx graph (lowercased nodes)."""
+        strings, u, v, w = self.edges()
+        G = nx.Graph()
+        G.add_nodes_from(self.ids)
+        G.add_weighted_edges_from(zip(strings[u].tolist(), strings[v].tolist(), w.tolist()))
+        return G
+
+
+def save_edges(path: Path, edges: Edges) -> None:
+    strings, u, v, w = edges
+    with open(path, "wb") as f:
+        np.savez(f, strings=pack_strings(strings.tolist()), u=u, v=v, w=w)
+
+def load_edges(path: Path) -> Edges:
+    with np.load(path) as f:
+        return np.array(unpack_strings(f["strings"]), dtype=str), f["u"], f["v"], f["w"]
+
+
+class CourseKG:
+    """Merged co-occurrence graph of a course, memory-mapped from <course>/kg/.
+
+    Files of generation g (the live one is named in kg/CURRENT):
+      strings.g.bin  sorted UTF-8 entity names, concatenated
+      offsets.g.npy  entity i is strings[offsets[i]:offsets[i + 1]]
+      prefixes.g.npy first 8 bytes of each name, for searchsorted lookups
+      indptr.g.npy, indices.g.npy, weights.g.npy  symmetric CSR adjacency
+    Opening parses nothing; see StringTable for how entities are found.
+    """
+
+    _ARRAYS = ("offsets", "prefixes", "indptr", "indices", "weights")
+
+    def __init__(self, table: StringTable, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray):
+        self.table = table
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @staticmethod
+    def directory(course_id) -> Path:
+        return course_dir(course_id) / "kg"
+
+    @classmethod
+    def open(cls, course_id) -> Optional["CourseKG"]:
+        try:
+            return cls._open(course_id)
+        except FileNotFoundError:
+            # Two swaps happened between reading CURRENT and opening its files
+            return cls._open(course_id)
+
+    @classmethod
+    def _open(cls, course_id) -> Optional["CourseKG"]:
+        kg_dir = cls.directory(course_id)
+        try:
+            gen = (kg_dir / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            return None
+        strings_path = kg_dir / f"strings.{gen}.bin"
+        # np.memmap refuses empty files
+        if strings_path.stat().st_size:
+            strings = np.memmap(strings_path, dtype=np.uint8, mode="r")
+        else:
+            strings = np.zeros(0, dtype=np.uint8)
+        offsets, prefixes, indptr, indices, weights = (
+            np.load(kg_dir / f"{name}.{gen}.npy", mmap_mode="r") for name in cls._ARRAYS
+        )
+        return cls(StringTable(strings, offsets, prefixes), indptr, indices, weights)
+
+    @classmethod
+    def from_arrays(cls, strings: np.ndarray, m: sparse.csr_matrix) -> "CourseKG":
+        return cls(StringTable(*encode_strings(strings.tolist())),
+                   m.indptr.astype(np.int64), m.indices.astype(np.int32), m.data.astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def entity(self, i: int) -> str:
+        return self.table[i]
+
+    def lookup(self, entity: str) -> Optional[int]:
+        return self.table.find(entity.lower())
+
+    def neighbors(self, entity: str, n: int = 8) -> List[Tuple[str, float]]:
+        """Up to n strongest neighbors, heaviest first."""
+        i = self.lookup(entity)
+        if i is None:
+            return []
+        s, e = self.indptr[i], self.indptr[i + 1]
+        idx, w = np.asarray(self.indices[s:e]), np.asarray(self.weights[s:e])
+        if len(w) > n:
+            top = np.argpartition(-w, n - 1)[:n]
+            idx, w = idx[top], w[top]
+        order = np.argsort(-w, kind="stable")
+        return [(self.entity(int(idx[j])), float(w[j])) for j in order]
+
+    def strings(self) -> np.ndarray:
+        return np.array(list(self.table), dtype=str)
+
+    def matrix(self) -> sparse.csr_matrix:
+        n = len(self)
+        return sparse.csr_matrix((np.asarray(self.weights), np.asarray(self.indices), np.asarray(self.indptr)), shape=(n, n))
+
+    def save(self, course_id) -> None:
+        """Write as the next generation and switch kg/CURRENT to it atomically."""
+        kg_dir = self.directory(course_id)
+        kg_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            old = (kg_dir / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            old = ""
+        gen = str(int(old) + 1) if old else "1"
+        (kg_dir / f"strings.{gen}.bin").write_bytes(np.asarray(self.table.data).tobytes())
+        arrays = (self.table.offsets, self.table.prefixes, self.indptr, self.indices, self.weights)
+        for name, arr in zip(self._ARRAYS, arrays):
+            np.save(kg_dir / f"{name}.{gen}.npy", np.asarray(arr))
+        tmp = kg_dir / "CURRENT.tmp"
+        tmp.write_text(gen)
+        os.replace(tmp, kg_dir / "CURRENT")
+        # Keep the previous generation until the next swap: a reader that has just
+        # read CURRENT may still be about to open it. Mapped files survive unlinking.
+        keep = {gen, old}
+        for path in kg_dir.glob("*.*.*"):
+            if path.name.split(".")[1] not in keep:
+                path.unlink(missing_ok=True)
+
+
+def _symmetric(strings: np.ndarray, edges: Edges, sign: int) -> sparse.coo_matrix:
+    e_strings, u, v, w = edges
+    ids = np.searchsorted(strings, e_strings)
+    rows, cols = ids[u], ids[v]
+    data = sign * np.asarray(w, dtype=np.int64)
+    n = len(strings)
+    return sparse.coo_matrix(
+        (np.concatenate([data, data]), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))), shape=(n, n)
+    )
+
+def _merge(base: Optional[CourseKG], remove: Optional[Edges], add: Optional[Edges]) -> CourseKG:
+    """base - remove + add, re-indexed over the union of their string tables."""
+    base_strings = base.strings() if base is not None else _no_strings()
+    strings = np.unique(np.concatenate([base_strings] + [e[0] for e in (remove, add) if e is not None]).astype(str))
+    n = len(strings)
+    m = sparse.csr_matrix((n, n), dtype=np.int64)
+    if base is not None and len(base):
+        c = base.matrix().tocoo()
+        ids = np.searchsorted(strings, base_strings)
+        m = m + sparse.coo_matrix((c.data.astype(np.int64), (ids[c.row], ids[c.col])), shape=(n, n))
+    for edges, sign in ((remove, -1), (add, 1)):
+        if edges is not None:
+            m = m + _symmetric(strings, edges, sign)
+    m = sparse.csr_matrix(m)
+    m.data[m.data < 0] = 0
+    m.eliminate_zeros()
+    # Entities whose last edge went away drop out of the string table
+    keep = np.flatnonzero(np.diff(m.indptr) > 0)
+    m = m[keep][:, keep].tocsr()
+    m.sort_indices()
+    return CourseKG.from_arrays(strings[keep], m)
+
+@contextmanager
+def _kg_lock(course_id):
+    kg_dir = CourseKG.directory(course_id)
+    kg_dir.mkdir(parents=True, exist_ok=True)
+    with open(kg_dir / ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def update_course_kg(course_id, material_id, new: Optional[Edges]) -> None:
+    """Replace one material's contribution to the merged course graph; new=None removes it.
+
+    The material's last edges are kept in <course>/<material>/edges.npz so they
+    can be subtracted again without re-reading any other material.
+    """
+    edges_path = course_dir(course_id) / str(material_id) / "edges.npz"
+    with _kg_lock(course_id):
+        old = load_edges(edges_path) if edges_path.exists() else None
+        _merge(CourseKG.open(course_id), old, new).save(course_id)
+        if new is not None:
+            edges_path.parent.mkdir(parents=True, exist_ok=True)
+            save_edges(edges_path, new)
+        else:
+            edges_path.unlink(missing_ok=True)
+
+def rebuild_course_kg(course_id) -> int:
+    """Rebuild the merged graph from every material's edges.npz, converting legacy
+    graph.graphml and entity_index.json files on the way. Returns the number of
+    materials merged."""
+    base = course_dir(course_id)
+    material_dirs = sorted(p for p in base.iterdir() if p.is_dir() and p.name.isdigit()) if base.exists() else []
+    with _kg_lock(course_id):
+        kg, merged = None, 0
+        for mdir in material_dirs:
+            if (mdir / "entity_index.json").exists() and not (mdir / "entities.bin").exists():
+                with open(mdir / "entity_index.json", encoding="utf-8") as f:
+                    write_entity_index(mdir / "entities.bin", json.load(f))
+                (mdir / "entity_index.json").unlink()
+            if (mdir / "edges.npz").exists():
+                edges = load_edges(mdir / "edges.npz")
+            elif (mdir / "graph.graphml").exists():
+                edges = graph_edges(nx.read_graphml(mdir / "graph.graphml"))
+                save_edges(mdir / "edges.npz", edges)
+            else:
+                continue
+            kg = _merge(kg, None, edges)
+            merged += 1
+        (kg or _merge(None, None, None)).save(course_id)
+    return merged
+
+
+class _JsonPostings:
+    """entity_index.json of a material indexed before entities.bin existed."""
+
+    def __init__(self, path: Path):
+        self._postings: Dict[str, List[str]] = {}
+        with open(path, encoding="utf-8") as f:
+            for entity, chunk_ids in json.load(f).items():
+                # Positional ints come from indexes built before chunk IDs were stored
+                self._postings.setdefault(entity.lower(), []).extend(c for c in chunk_ids if isinstance(c, str))
+
+    def postings(self, entity: str) -> List[str]:
+        return self._postings.get(entity.lower(), [])
+
+
+class CourseGraph:
+    """Query-side view of a course KG: the merged adjacency plus each material's
+    entity -> chunk IDs postings, keyed by lowercased entity."""
+
+    def __init__(self, kg: Optional[CourseKG], indexes: List, max_neighbors: int = 8):
+        self.kg = kg
+        self.indexes = indexes
+        self.max_neighbors = max_neighbors
+
+    @classmethod
+    def load(cls, course_id, max_neighbors: int = 8) -> "CourseGraph":
+        indexes = []
+        base = course_dir(course_id)
+        material_dirs = sorted(p for p in base.iterdir() if p.is_dir()) if base.exists() else []
+        for mdir in material_dirs:
+            if (mdir / "entities.bin").exists():
+                indexes.append(EntityIndex(mdir / "entities.bin"))
+            elif (mdir / "entity_index.json").exists():
+                indexes.append(_JsonPostings(mdir / "entity_index.json"))
+        return cls(CourseKG.open(course_id), indexes, max_neighbors)
+
+    def postings(self, entity: str) -> List[str]:
+        return [c for index in self.indexes for c in index.postings(entity)]
+
+    def expand(self, entities: Iterable[str], decay: float = 0.5, deadline: Optional[float] = None) -> Dict[str, float]:
+        """Query entities (weight 1) plus their strongest neighbors (weight <= decay)."""
+        weights: Dict[str, float] = {}
+        for e in entities:
+            e = e.lower()
+            weights[e] = 1.0
+        if self.kg is None:
+            return weights
+        for e in list(weights):
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            nbrs = self.kg.neighbors(e, self.max_neighbors)
+            if not nbrs:
+                continue
+            top = nbrs[0][1]
+            for n, w in nbrs:
+                weights[n] = max(weights.get(n, 0.0), decay * w / top)
+        return weights
+
+    def candidates(self, weights: Dict[str, float], k: int = 24, deadline: Optional[float] = None) -> List[str]:
+        """Chunk IDs ranked by the summed weight of the (expanded) entities they contain."""
+        scores: Dict[str, float] = {}
+        for e, w in weights.items():
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            for chunk_id in self.postings(e):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + w
+        return heapq.nlargest(k, scores, key=scores.get)
+
+
+_GRAPHS: Dict[str, Tuple[int, CourseGraph]] = {}
+_LOADING = set()
+_LOCK = threading.Lock()
+
+def _load(course_id: str, version: int) -> None:
+    try:
+        graph = CourseGraph.load(course_id, int(getattr(settings, "ASSISTANT_KG_MAX_NEIGHBORS", 8)))
+        with _LOCK:
+            _GRAPHS[course_id] = (version, graph)
+    except Exception as e:
+        logger.exception("Loading knowledge graph for course %s failed: %s", course_id, e)
+    finally:
+        with _LOCK:
+            _LOADING.discard(course_id)
+
+def course_graph(course_id, block: bool = False) -> Optional[CourseGraph]:
+    """Cached course graph for the current index version.
+
+    With block=False a missing or outdated graph is (re)loaded in a background
+    thread and the previous version (or None) is returned, so requests never wait
+    on loading postings.
+    """
+    course_id = str(course_id)
+    version = index_version(course_id)
+    entry = _GRAPHS.get(course_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    if block:
+        _load(course_id, version)
+        entry = _GRAPHS.get(course_id)
+        return entry[1] if entry else None
+    with _LOCK:
+        if course_id not in _LOADING:
+            _LOADING.add(course_id)
+            threading.Thread(target=_load, args=(course_id, version), daemon=True).start()
+    return entry[1] if entry else None
+
+def kg_candidates(course_id, query_ents: List[str], k: int = 24) -> List[str]:
+    """Chunk IDs reached by expanding the query entities over the course KG.
+    Whatever is left once ASSISTANT_KG_BUDGET_MS has elapsed is skipped."""
+    graph = course_graph(course_id)
+    if graph is None or not query_ents:
+        return []
+    deadline = time.perf_counter() + float(getattr(settings, "ASSISTANT_KG_BUDGET_MS", 5)) / 1000
+    weights = graph.expand(query_ents, deadline=deadline)
+    return graph.candidates(weights, k=k, deadline=deadline)
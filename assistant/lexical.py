@@ -0,0 +1,163 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .stores import course_dir, index_version
+
+_TOKEN = re.compile(r"\w+(?:[-.]\w+)*")
+MAX_TOKEN_LEN = 40
+
+def tokenize(text: str) -> List[str]:
+    # Keeps course codes / formula names like "cs-101" or "f.1" as single terms
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) <= MAX_TOKEN_LEN]
+
+def pack_strings(items: Iterable[str]) -> np.ndarray:
+    return np.frombuffer("\0".join(items).encode("utf-8"), dtype=np.uint8)
+
+def unpack_strings(arr: np.ndarray) -> List[str]:
+    raw = arr.tobytes().decode("utf-8")
+    return raw.split("\0") if raw else []
+
+
+class Bm25Builder:
+    """Collects term frequencies per chunk and writes a material's postings.
+
+    File layout (bm25.npz): `terms` and `chunk_ids` as NUL-joined UTF-8, and
+    CSR postings: docs/tfs of term i are docs[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self):
+        self.chunk_ids: List[str] = []
+        self.doc_len: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+
+    def add(self, chunk_id: str, text: str) -> None:
+        doc = len(self.chunk_ids)
+        tokens = tokenize(text)
+        self.chunk_ids.append(chunk_id)
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc, tf))
+
+    def save(self, path: Path) -> None:
+        terms = sorted(self.postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        docs, tfs = [], []
+        for i, term in enumerate(terms):
+            plist = self.postings[term]
+            indptr[i + 1] = indptr[i] + len(plist)
+            docs.extend(d for d, _ in plist)
+            tfs.extend(tf for _, tf in plist)
+        # Write then rename, so a reader never loads a half-written file
+        tmp = Path(path).with_name(Path(path).name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                terms=pack_strings(terms),
+                chunk_ids=pack_strings(self.chunk_ids),
+                indptr=indptr,
+                docs=np.asarray(docs, dtype=np.int32),
+                tfs=np.asarray(tfs, dtype=np.int32),
+                doc_len=np.asarray(self.doc_len, dtype=np.int32),
+            )
+        os.replace(tmp, path)
+
+
+class LexicalIndex:
+    """In-memory BM25 index over every material of one course."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunk_ids: List[str] = []
+        self._doc_len = np.zeros(0, dtype=np.int32)
+        self._norm = np.zeros(0, dtype=np.float32)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def load(cls, paths: Sequence[Path]) -> "LexicalIndex":
+        index = cls()
+        parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        doc_lens = []
+        for path in paths:
+            with np.load(path) as f:
+                offset = len(index.chunk_ids)
+                index.chunk_ids.extend(unpack_strings(f["chunk_ids"]))
+                doc_lens.append(f["doc_len"])
+                indptr, docs, tfs = f["indptr"], f["docs"] + offset, f["tfs"]
+                for i, term in enumerate(unpack_strings(f["terms"])):
+                    s, e = indptr[i], indptr[i + 1]
+                    parts.setdefault(term, []).append((docs[s:e], tfs[s:e]))
+        for term, plist in parts.items():
+            if len(plist) == 1:
+                index._postings[term] = plist[0]
+            else:
+                index._postings[term] = (np.concatenate([d for d, _ in plist]), np.concatenate([t for _, t in plist]))
+        if doc_lens:
+            index._doc_len = np.concatenate(doc_lens)
+            avgdl = float(index._doc_len.mean()) or 1.0
+            # Per-document BM25 length normalization, precomputed once
+            index._norm = (index.k1 * (1 - index.b + index.b * index._doc_len / avgdl)).astype(np.float32)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def search(self, query: str, k: int = 24) -> List[Tuple[str, float]]:
+        n = len(self.chunk_ids)
+        if not n:
+            return []
+        scores = None
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            df = len(docs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            contrib = idf * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+            if scores is None:
+                scores = np.zeros(n, dtype=np.float32)
+            np.add.at(scores, docs, contrib)
+        if scores is None:
+            return []
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> Dict[str, float]:
+    """RRF: score(id) = sum over rankings of 1 / (k + rank), rank starting at 1."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+_INDEXES: Dict[str, Tuple[int, LexicalIndex]] = {}
+_LOCK = threading.Lock()
+
+def course_lexical_index(course_id) -> LexicalIndex:
+    """Merged BM25 index of a course, reloaded when its index version changes."""
+    course_id = str(course_id)
+    version = index_version(course_id)
+    entry = _INDEXES.get(course_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    with _LOCK:
+        entry = _INDEXES.get(course_id)
+        if entry is None or entry[0] != version:
+            index = LexicalIndex.load(sorted(course_dir(course_id).glob("*/bm25.npz")))
+            entry = (version, index)
+            _INDEXES[course_id] = entry
+    return entry[1]
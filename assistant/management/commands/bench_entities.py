@@ -0,0 +1,46 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from assistant.pipeline import chunk_pages, extract_entities, extract_entities_batch, extract_text_per_page
+
+_WORDS = (
+    "algorithm matrix theorem proof lecture Newton Euler gradient network graph database "
+    "student professor Skopje Europe University integral vector kernel compiler protocol"
+).split()
+
+
+def _synthetic_chunks(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(_WORDS) for _ in range(180)) + "." for _ in range(n)]
+
+
+class Command(BaseCommand):
+    help = "Compare per-chunk vs batched (nlp.pipe) entity extraction throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf", help="Benchmark on the chunks of this PDF instead of synthetic text.")
+        parser.add_argument("--chunks", type=int, default=500)
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--n-process", type=int, default=1)
+
+    def handle(self, *args, **opts):
+        if opts["pdf"]:
+            texts = [c["text"] for c in chunk_pages(extract_text_per_page(opts["pdf"]))]
+        else:
+            texts = _synthetic_chunks(opts["chunks"])
+        extract_entities("warm up")  # exclude model load from both timings
+
+        t0 = time.perf_counter()
+        single = [extract_entities(t) for t in texts]
+        t1 = time.perf_counter()
+        batched = list(extract_entities_batch(texts, batch_size=opts["batch_size"], n_process=opts["n_process"]))
+        t2 = time.perf_counter()
+
+        n = len(texts)
+        self.stdout.write(f"chunks:       {n}")
+        self.stdout.write(f"per-chunk:    {n / (t1 - t0):8.1f} chunks/s")
+        self.stdout.write(f"nlp.pipe:     {n / (t2 - t1):8.1f} chunks/s "
+                          f"(batch_size={opts['batch_size']}, n_process={opts['n_process']})")
+        self.stdout.write(f"identical:    {single == batched}")
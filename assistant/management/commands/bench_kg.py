@@ -0,0 +1,63 @@
+import random
+import time
+
+import networkx as nx
+from django.core.management.base import BaseCommand
+
+from assistant.kg import CooccurrenceBuilder
+
+
+def _synthetic_entities(n: int, per_chunk: int, vocab: int, seed: int = 0):
+    rnd = random.Random(seed)
+    names = [f"concept{i}" for i in range(vocab)]
+    return [sorted(rnd.sample(names, per_chunk)) for _ in range(n)]
+
+
+def _pairwise(chunks) -> nx.Graph:
+    # The per-pair networkx loop the pipeline used before CooccurrenceBuilder
+    G = nx.Graph()
+    for ents in chunks:
+        G.add_nodes_from(ents)
+        for i in range(len(ents)):
+            for j in range(i + 1, len(ents)):
+                u, v = ents[i], ents[j]
+                if G.has_edge(u, v):
+                    G[u][v]["weight"] += 1
+                else:
+                    G.add_edge(u, v, weight=1)
+    return G
+
+
+class Command(BaseCommand):
+    help = "Compare pairwise networkx vs sparse incidence-matrix co-occurrence construction."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=2000)
+        parser.add_argument("--entities", type=int, default=200, help="Entities per chunk.")
+        parser.add_argument("--vocab", type=int, default=5000, help="Distinct entities in the corpus.")
+        parser.add_argument("--skip-pairwise", action="store_true", help="Only time the sparse builder.")
+
+    def handle(self, *args, **opts):
+        chunks = _synthetic_entities(opts["chunks"], opts["entities"], opts["vocab"])
+
+        t0 = time.perf_counter()
+        kg = CooccurrenceBuilder()
+        for i, ents in enumerate(chunks):
+            kg.add(i, ents)
+        strings, u, v, w = kg.edges()
+        t1 = time.perf_counter()
+
+        self.stdout.write(f"chunks:       {len(chunks)} x {opts['entities']} entities")
+        self.stdout.write(f"edges:        {len(w)}")
+        self.stdout.write(f"sparse:       {t1 - t0:8.2f} s")
+        if opts["skip_pairwise"]:
+            return
+
+        G = _pairwise(chunks)
+        t2 = time.perf_counter()
+        same = G.number_of_edges() == len(w) and all(
+            G[a][b]["weight"] == c for a, b, c in zip(strings[u].tolist(), strings[v].tolist(), w.tolist())
+        )
+        self.stdout.write(f"pairwise:     {t2 - t1:8.2f} s")
+        self.stdout.write(f"speedup:      {(t2 - t1) / (t1 - t0):8.1f}x")
+        self.stdout.write(f"identical:    {same}")
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# What each kind of worker imports at startup
+SCENARIOS = {
+    "web": "import django; django.setup(); import LMSProject.urls",
+    "asgi": "import LMSProject.asgi",
+    "assistant": "import django; django.setup(); import LMSProject.urls, assistant.qa, assistant.pipeline",
+}
+
+_REPORT = "import resource, sys; print('RSS', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)"
+
+
+def _measure(code: str):
+    env = {**os.environ, "ASSISTANT_WARMUP": "0"}
+    env.setdefault("DJANGO_SETTINGS_MODULE", "LMSProject.settings")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{code}\n{_REPORT}"],
+        env=env, capture_output=True, text=True,
+    )
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    total_us, rss_kb = 0, 0
+    packages = defaultdict(int)
+    for line in proc.stderr.splitlines():
+        if line.startswith("RSS "):
+            rss_kb = int(line.split()[1])
+        elif line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            self_us, _cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            total_us += int(self_us)
+            packages[name.split(".")[0]] += int(self_us)
+    return total_us / 1000, rss_kb / 1024, packages
+
+
+class Command(BaseCommand):
+    help = "Measure import time (python -X importtime) and peak RSS of each worker's startup."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Any of {', '.join(SCENARIOS)} (default: all).")
+        parser.add_argument("--top", type=int, default=8, help="Heaviest top-level packages to list.")
+
+    def handle(self, *args, **opts):
+        for name in opts["scenarios"] or SCENARIOS:
+            if name not in SCENARIOS:
+                raise CommandError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+            ms, rss, packages = _measure(SCENARIOS[name])
+            self.stdout.write(f"{name:<10} imports {ms:8.0f} ms   peak RSS {rss:6.0f} MB")
+            for pkg, us in sorted(packages.items(), key=lambda t: t[1], reverse=True)[:opts["top"]]:
+                self.stdout.write(f"    {pkg:<24} {us / 1000:8.1f} ms")
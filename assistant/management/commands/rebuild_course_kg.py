@@ -0,0 +1,24 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from assistant.kg import rebuild_course_kg
+from assistant.stores import bump_index_version
+
+
+class Command(BaseCommand):
+    help = "Rebuild the merged per-course knowledge graph (also converts legacy graph.graphml files)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_ids", nargs="*", help="Courses to rebuild (default: every course under AI_DB_DIR).")
+
+    def handle(self, *args, **opts):
+        base = Path(settings.AI_DB_DIR)
+        course_ids = opts["course_ids"] or sorted(p.name for p in base.iterdir() if p.is_dir() and p.name.isdigit())
+        for course_id in course_ids:
+            start = time.perf_counter()
+            merged = rebuild_course_kg(course_id)
+            bump_index_version(course_id)
+            self.stdout.write(f"Course {course_id}: merged {merged} material(s) in {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from assistant.jobs import claim_next, requeue_stale, run_job, worker_name
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run a bounded pool of workers that process queued material indexing jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=getattr(settings, "ASSISTANT_INDEX_WORKERS", 2))
+        parser.add_argument("--poll", type=float, default=2.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due instead of polling.")
+        parser.add_argument("--requeue-every", type=float, default=60.0,
+                            help="Seconds between checks for jobs whose worker died (see ASSISTANT_INDEX_JOB_TIMEOUT).")
+
+    def handle(self, *args, **opts):
+        stop = threading.Event()
+        self._requeue_stale()
+
+        def loop():
+            name = worker_name()
+            try:
+                while not stop.is_set():
+                    try:
+                        close_old_connections()
+                        job = claim_next(name)
+                        if job is None:
+                            if opts["once"]:
+                                return
+                            stop.wait(opts["poll"])
+                            continue
+                        run_job(job)
+                    except Exception:
+                        # e.g. "database is locked": keep the worker alive, the job
+                        # (if any) is picked up again by requeue_stale
+                        logger.exception("Indexing worker %s failed; continuing", name)
+                        stop.wait(opts["poll"])
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=loop, name=f"index-worker-{i}") for i in range(max(1, opts["workers"]))]
+        for t in threads:
+            t.start()
+        self.stdout.write(f"Started {len(threads)} indexing worker(s).")
+        try:
+            next_requeue = time.monotonic() + opts["requeue_every"]
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+                if time.monotonic() >= next_requeue:
+                    next_requeue = time.monotonic() + opts["requeue_every"]
+                    self._requeue_stale()
+        except KeyboardInterrupt:
+            # Let running jobs finish; they are marked done/pending before the thread exits
+            self.stdout.write("Stopping after current jobs...")
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def _requeue_stale(self) -> None:
+        try:
+            requeued = requeue_stale()
+        except Exception:
+            logger.exception("Requeueing stale indexing jobs failed")
+            return
+        finally:
+            close_old_connections()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0001_initial'),
+        ('courses', '0010_enrollment_uniq_course_student_enrollment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexingjob',
+            name='action',
+            field=models.CharField(choices=[('index', 'Index'), ('remove', 'Remove')], default='index', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='indexingjob',
+            name='course_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexingjob',
+            name='removed_material_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='indexingjob',
+            name='material',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='indexing_jobs', to='courses.coursematerial'),
+        ),
+    ]
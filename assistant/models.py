@@ -1,3 +1,50 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class IndexingJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    INDEX = "index"
+    REMOVE = "remove"
+
+    ACTION_CHOICES = [
+        (INDEX, "Index"),
+        (REMOVE, "Remove"),
+    ]
+
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=INDEX)
+    # Unset for REMOVE jobs: the material row is already gone, so its ids are kept below
+    material = models.ForeignKey("courses.CourseMaterial", on_delete=models.CASCADE, related_name="indexing_jobs",
+                                 null=True, blank=True)
+    course_id = models.IntegerField(null=True, blank=True)
+    removed_material_id = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        if self.action == self.REMOVE:
+            return f"Remove {self.removed_material_id} ({self.status}, attempt {self.attempts})"
+        return f"Index {self.material_id} ({self.status}, attempt {self.attempts})"
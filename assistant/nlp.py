@@ -0,0 +1,16 @@
+import threading
+
+import spacy
+from django.conf import settings
+
+_NLP = None
+_LOCK = threading.Lock()
+
+def nlp():
+    """The process-wide spaCy pipeline, shared by ingestion and the query path."""
+    global _NLP
+    if _NLP is None:
+        with _LOCK:
+            if _NLP is None:
+                _NLP = spacy.load(getattr(settings, "ASSISTANT_SPACY_MODEL", "en_core_web_sm"))
+    return _NLP
@@ -0,0 +1,53 @@
+# PDF page text extraction. Kept free of Django/spaCy/langchain imports so
+# spawned worker processes only pay for importing fitz.
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+import fitz
+
+
+def page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    # Runs in a worker process: each worker opens its own document handle
+    with fitz.open(pdf_path) as doc:
+        return [(i + 1, doc[i].get_text()) for i in range(start, stop)]
+
+def _iter_sequential(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    with fitz.open(pdf_path) as doc:
+        for i, page in enumerate(doc, start=1):
+            yield i, page.get_text()
+
+def iter_text_per_page(pdf_path: str, workers: int = 1, pages_per_task: int = 16) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) in page order.
+
+    With workers > 1 the page range is split into slices of `pages_per_task`
+    pages and extracted in a process pool. At most 2 * workers slices are in
+    flight, so memory stays flat however large the PDF is.
+    """
+    n = page_count(pdf_path)
+    if workers <= 1 or n <= pages_per_task:
+        yield from _iter_sequential(pdf_path)
+        return
+
+    ranges = iter([(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)])
+    # spawn: forking a threaded index worker can deadlock on inherited locks
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = deque()
+        for start, stop in ranges:
+            pending.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            yield from pending.popleft().result()
+            nxt = next(ranges, None)
+            if nxt is not None:
+                pending.append(pool.submit(_extract_page_range, pdf_path, *nxt))
+
+def extract_text_per_page(pdf_path: str, workers: int = 1) -> List[Tuple[int, str]]:
+    return list(iter_text_per_page(pdf_path, workers=workers))
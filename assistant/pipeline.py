@@ -1,131 +1,310 @@
-import json
+import hashlib
+import logging
 import os
+import queue
+import shutil
+import threading
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable, Iterator, Optional
 
-import fitz
-import networkx as nx
-import spacy
 from django.conf import settings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
 
-_NLP = None
-def nlp():
-    global _NLP
-    if _NLP is None:
-        _NLP = spacy.load("en_core_web_sm")
-    return _NLP
+from .embeddings import embedding_cache, get_embeddings
+from .lexical import Bm25Builder
+from .pdftext import extract_text_per_page, iter_text_per_page
+from .postings import write_entity_index
+from .kg import CooccurrenceBuilder, update_course_kg
+from .nlp import nlp
+from .stores import invalidate_course_store
+from .tokens import count_tokens_batch, exact_token_model, token_model
+
+logger = logging.getLogger(__name__)
 
 def _material_dir(course_id: int, material_id: int) -> Path:
     base = Path(settings.AI_DB_DIR) / str(course_id) / str(material_id)
     base.mkdir(parents=True, exist_ok=True)
     return base
 
-def extract_text_per_page(pdf_path: str) -> List[Tuple[int, str]]:
-    doc = fitz.open(pdf_path)
-    pages = []
-    for i, page in enumerate(doc, start=1):
-        pages.append((i, page.get_text()))
-    return pages
+def iter_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    return iter_text_per_page(
+        pdf_path,
+        workers=int(getattr(settings, "ASSISTANT_PDF_WORKERS", 1)),
+        pages_per_task=int(getattr(settings, "ASSISTANT_PDF_PAGES_PER_TASK", 16)),
+    )
 
-def chunk_pages(pages: List[Tuple[int, str]]) -> List[Dict]:
+def iter_chunks(pages: Iterable[Tuple[int, str]]) -> Iterator[Dict]:
     # Chunk by ~1200 chars with 200 overlap to support large PDFs
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=1200,
         chunk_overlap=200,
         separators=["\n\n", "\n", ". ", " ", ""],
     )
-    chunks = []
+    idx = 0
     for page_num, text in pages:
         for chunk in splitter.split_text(text):
-            chunks.append({"page": page_num, "text": chunk})
-    return chunks
+            yield {"idx": idx, "page": page_num, "text": chunk}
+            idx += 1
 
-def extract_entities(text: str) -> List[str]:
-    doc = nlp()(text)
+def chunk_pages(pages: Iterable[Tuple[int, str]]) -> List[Dict]:
+    return list(iter_chunks(pages))
+
+# Entity extraction only needs tagger/lemmatizer (for POS + lemmas) and NER
+_NER_DISABLE = ["parser"]
+_NER_LABELS = {"PERSON","ORG","GPE","LOC","PRODUCT","EVENT","WORK_OF_ART","NORP"}
+
+def _entities_from_doc(doc) -> List[str]:
     # Keep common academic NER types + nouns (simple boost)
-    ents = {ent.text.strip() for ent in doc.ents if ent.label_ in {
-        "PERSON","ORG","GPE","LOC","PRODUCT","EVENT","WORK_OF_ART","NORP"
-    }}
+    ents = {ent.text.strip() for ent in doc.ents if ent.label_ in _NER_LABELS}
     # Add top nouns as lightweight concepts
     ents |= {t.lemma_ for t in doc if t.pos_ in {"NOUN","PROPN"} and len(t) > 2}
     # Clean / dedupe
     cleaned = sorted({e for e in ents if any(c.isalnum() for c in e)})
     return cleaned
 
-def build_light_kg(chunks: List[Dict]) -> Tuple[nx.Graph, Dict[str, List[int]]]:
-    """Build a simple co-occurrence knowledge graph:
-    - Nodes: entities
-    - Edge: entities that co-occur within the same chunk
-    Return (graph, entity->chunk_ids index).
+def extract_entities(text: str) -> List[str]:
+    return _entities_from_doc(nlp()(text))
+
+def extract_entities_batch(
+    texts: Iterable[str],
+    batch_size: Optional[int] = None,
+    n_process: Optional[int] = None,
+) -> Iterator[List[str]]:
+    """Batched extract_entities over nlp.pipe; yields one entity list per text, in order."""
+    for doc in nlp().pipe(texts, disable=_NER_DISABLE, **_pipe_options(batch_size, n_process)):
+        yield _entities_from_doc(doc)
+
+def annotate_entities(
+    chunks: Iterable[Dict],
+    batch_size: Optional[int] = None,
+    n_process: Optional[int] = None,
+) -> Iterator[Dict]:
+    """Streaming NER stage: sets chunk["entities"] and yields each chunk as its batch completes.
+    Chunks that already carry entities (unchanged on re-index) are passed through untouched.
+    """
+    # Known chunks go through as "" to keep ordering without paying for NER
+    items = (("" if "entities" in c else c["text"], c) for c in chunks)
+    for doc, c in nlp().pipe(items, as_tuples=True, disable=_NER_DISABLE, **_pipe_options(batch_size, n_process)):
+        if "entities" not in c:
+            c["entities"] = _entities_from_doc(doc)  # store on chunk for later filtering/boosting
+        yield c
+
+def _pipe_options(batch_size: Optional[int], n_process: Optional[int]) -> Dict[str, int]:
+    return {
+        "batch_size": batch_size or int(getattr(settings, "ASSISTANT_NER_BATCH_SIZE", 64)),
+        "n_process": n_process or int(getattr(settings, "ASSISTANT_NER_PROCESSES", 1)),
+    }
+
+# --- Streaming stages ---------------------------------------------------------
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_STAGE_DONE = object()
+
+def _threaded(items: Iterable, maxsize: int) -> Iterator:
+    """Run an iterator in a background thread behind a bounded queue.
+
+    The producer overlaps with whoever consumes the returned iterator but never
+    gets more than `maxsize` items ahead. Errors are re-raised in the consumer,
+    and closing the consumer stops the producer.
     """
-    G = nx.Graph()
-    index: Dict[str, List[int]] = {}
-    for idx, c in enumerate(chunks):
-        ents = extract_entities(c["text"])
-        for e in ents:
-            index.setdefault(e, []).append(idx)
-            if not G.has_node(e):
-                G.add_node(e)
-        # Co-occurrence edges
-        for i in range(len(ents)):
-            for j in range(i + 1, len(ents)):
-                u, v = ents[i], ents[j]
-                if G.has_edge(u, v):
-                    G[u][v]["weight"] += 1
-                else:
-                    G.add_edge(u, v, weight=1)
-        c["entities"] = ents  # store on chunk for later filtering/boosting
-    return G, index
+    q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_STAGE_DONE)
+        except BaseException as e:
+            put(_StageError(e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is _STAGE_DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
 
 def _embedding():
-    return OllamaEmbeddings(model=getattr(settings, "OLLAMA_EMBED_MODEL", "nomic-embed-text"))
+    return get_embeddings()
+
+def _embed_batch_size() -> int:
+    return int(getattr(settings, "ASSISTANT_EMBED_BATCH_SIZE", 64))
 
-def upsert_chroma(course_id: int, material_id: int, material_title: str, chunks: List[Dict], persist_dir: str):
-    embed = _embedding()
+def _course_store(course_id: int, persist_dir: str) -> Chroma:
     # One Chroma per course to allow cross-material retrieval, but we store rich metadata
     course_dir = Path(persist_dir) / str(course_id)
     course_dir.mkdir(parents=True, exist_ok=True)
-    db = Chroma(persist_directory=str(course_dir), embedding_function=embed)
+    return Chroma(persist_directory=str(course_dir), embedding_function=_embedding())
 
-    texts = [c["text"] for c in chunks]
-    metadatas = [{
+def with_chunk_ids(chunks: Iterable[Dict], material_id: int, known: Optional[Dict[str, Dict]] = None) -> Iterator[Dict]:
+    """Give every chunk a content-addressed ID: m<material>_h<sha256 prefix>[_n].
+
+    Unchanged text keeps its ID even when it moves to another position or page,
+    so re-indexing only has to embed new/changed chunks. `known` maps existing
+    IDs to their stored metadata; matching chunks reuse the stored entities.
+    """
+    known = known or {}
+    seen: Dict[str, int] = {}
+    for c in chunks:
+        digest = hashlib.sha256(c["text"].encode("utf-8")).hexdigest()[:16]
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        # Repeated identical chunks within a material get an occurrence suffix
+        c["id"] = f"m{material_id}_h{digest}" + (f"_{n}" if n else "")
+        prev = known.get(c["id"])
+        if prev is not None and prev.get("entities") is not None:
+            c["entities"] = list(prev["entities"])
+        yield c
+
+def _chunk_metadata(course_id: int, material_id: int, material_title: str, c: Dict) -> Dict:
+    return {
         "course_id": str(course_id),
         "material_id": str(material_id),
         "material_title": material_title,
         "page": c["page"],
         "entities": c.get("entities", []),
-    } for c in chunks]
+        "tokens": c["tokens"],
+        "token_model": c["token_model"],
+    }
 
-    # IDs ensure idempotent-ish adds per material; include material and local index
-    ids = [f"m{material_id}_c{i}" for i in range(len(chunks))]
-    db.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-    db.persist()
+def _count_chunk_tokens(chunks: List[Dict]) -> None:
+    # Precomputed for context packing at query time (see views.select_context)
+    todo = [c for c in chunks if "tokens" not in c]
+    counts = count_tokens_batch([c["text"] for c in todo])
+    # "" marks length estimates (no tokenizer): chunk_tokens and the next re-index recount them
+    model = exact_token_model()
+    for c, n in zip(todo, counts):
+        c["tokens"] = n
+        c["token_model"] = model
+
+def _add_chunks(db: Chroma, course_id: int, material_id: int, material_title: str, chunks: List[Dict]):
+    _count_chunk_tokens(chunks)
+    texts = [c["text"] for c in chunks]
+    metadatas = [_chunk_metadata(course_id, material_id, material_title, c) for c in chunks]
+    db.add_texts(texts=texts, metadatas=metadatas, ids=[c["id"] for c in chunks])
+
+def _stored_chunks(db: Chroma, material_id: int) -> Dict[str, Dict]:
+    got = db.get(where={"material_id": str(material_id)}, include=["metadatas"])
+    return dict(zip(got["ids"], got["metadatas"]))
+
+def _sync_chunks(db: Chroma, known: Dict[str, Dict], course_id: int, material_id: int, material_title: str, chunks: List[Dict]) -> int:
+    """Embed only chunks whose ID is new; refresh metadata of kept chunks that moved
+    (or whose token count is missing or stale). Returns #embedded."""
+    new = [c for c in chunks if c["id"] not in known]
+    if new:
+        _add_chunks(db, course_id, material_id, material_title, new)
+    moved = [c for c in chunks if c["id"] in known and (
+        known[c["id"]].get("page") != c["page"]
+        or known[c["id"]].get("material_title") != material_title
+        or known[c["id"]].get("token_model") != token_model()
+    )]
+    if moved:
+        _count_chunk_tokens(moved)
+        # Metadata-only update: the stored vector is reused as is
+        db._collection.update(
+            ids=[c["id"] for c in moved],
+            metadatas=[_chunk_metadata(course_id, material_id, material_title, c) for c in moved],
+        )
+    return len(new)
 
 def process_material(material) -> None:
     """
     Orchestrates: PDF -> pages -> chunks -> entities -> KG -> Chroma upsert.
+    The stages are streamed: extraction, chunking and NER each run in their own
+    thread behind bounded queues, while this thread grows the KG and flushes
+    embeddings to Chroma every ASSISTANT_EMBED_BATCH_SIZE chunks, so memory
+    depends on the queue/batch sizes rather than the PDF size.
+    Re-indexing is incremental: chunks are content-hashed, unchanged chunks keep
+    their vectors and entities, and chunks no longer present are deleted.
     Saves:
-      - GraphML at db/courses/<course>/<material>/graph.graphml
-      - Entity->chunks map at .../entity_index.json
+      - Co-occurrence edges at db/courses/<course>/<material>/edges.npz, merged
+        into the course graph at db/courses/<course>/kg/
+      - Entity->chunk IDs postings at .../entities.bin (see postings.EntityIndex)
+      - BM25 postings (keyed by chunk ID) at .../bm25.npz
     """
     course_id = material.course.id
     material_id = material.id
     title = material.title
     pdf_path = material.upload.path
 
-    # 1) Extract and chunk
-    pages = extract_text_per_page(pdf_path)
-    chunks = chunk_pages(pages)
+    maxsize = int(getattr(settings, "ASSISTANT_STREAM_QUEUE_SIZE", 256))
+    db = _course_store(course_id, str(settings.AI_DB_DIR))
+    known = _stored_chunks(db, material_id)
+
+    # 1) Extract, chunk and tag entities as connected background stages
+    pages = _threaded(iter_pages(pdf_path), maxsize)
+    chunks = _threaded(with_chunk_ids(iter_chunks(pages), material_id, known), maxsize)
+    chunks = _threaded(annotate_entities(chunks), maxsize)
+
+    # 2) Grow light knowledge graph + entity index, 3) sync per-course Chroma in batches
+    kg = CooccurrenceBuilder()
+    bm25 = Bm25Builder()
+    current = set()
+    embedded = 0
+    for batch in _batched(chunks, _embed_batch_size()):
+        for c in batch:
+            kg.add(c["id"], c["entities"])
+            bm25.add(c["id"], c["text"])
+            current.add(c["id"])
+        embedded += _sync_chunks(db, known, course_id, material_id, title, batch)
+
+    stale = [i for i in known if i not in current]
+    if stale:
+        db.delete(ids=stale)
+    db.persist()
+    logger.info("Material %s: %s chunks, %s embedded, %s stale removed (embedding cache %s)",
+                material_id, len(current), embedded, len(stale), embedding_cache().stats())
 
-    # 2) Build light knowledge graph + entity index
-    G, entity_index = build_light_kg(chunks)
     mdir = _material_dir(course_id, material_id)
-    nx.write_graphml(G, mdir / "graph.graphml")
-    with open(mdir / "entity_index.json", "w", encoding="utf-8") as f:
-        json.dump(entity_index, f, ensure_ascii=False, indent=2)
+    update_course_kg(course_id, material_id, kg.edges())
+    (mdir / "graph.graphml").unlink(missing_ok=True)
+    write_entity_index(mdir / "entities.bin", kg.index)
+    (mdir / "entity_index.json").unlink(missing_ok=True)
+    bm25.save(mdir / "bm25.npz")
+
+    # Vectors and lexical postings are both written: let readers reopen
+    invalidate_course_store(course_id)
+
+    # Deleted while we were indexing: its removal job may already have run, and
+    # everything above re-created what it dropped. Checked after the last write,
+    # so a delete after this point queues a removal that runs after us.
+    if not type(material).objects.filter(pk=material_id).exists():
+        logger.info("Material %s was deleted during indexing; removing its indexes", material_id)
+        remove_material(course_id, material_id)
 
-    # 3) Upsert into per-course Chroma vectorstore with metadata
-    upsert_chroma(course_id, material_id, title, chunks, persist_dir=str(settings.AI_DB_DIR))
+def remove_material(course_id: int, material_id: int) -> None:
+    """Drop a deleted material's vectors, KG contribution and index files."""
+    db = _course_store(course_id, str(settings.AI_DB_DIR))
+    stale = list(_stored_chunks(db, material_id))
+    if stale:
+        db.delete(ids=stale)
+        db.persist()
+    update_course_kg(course_id, material_id, None)
+    shutil.rmtree(Path(settings.AI_DB_DIR) / str(course_id) / str(material_id), ignore_errors=True)
+    invalidate_course_store(course_id)
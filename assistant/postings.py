@@ -0,0 +1,190 @@
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_MAGIC = b"LMSPOST1"
+# magic + uint64 n_entities, n_chunks and the byte offsets of the seven sections
+_HEADER = len(_MAGIC) + 9 * 8
+
+
+def _prefix_keys(encoded: List[bytes]) -> np.ndarray:
+    # First 8 bytes as a big-endian integer, so integer order == byte order
+    return np.array([int.from_bytes(b[:8].ljust(8, b"\0"), "big") for b in encoded], dtype=">u8")
+
+def encode_strings(strings: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(data, offsets, prefixes) arrays of a StringTable; `strings` must be sorted."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, _prefix_keys(encoded)
+
+
+class StringTable:
+    """Sorted UTF-8 strings over (possibly memory-mapped) flat arrays.
+
+    `find` narrows to the strings sharing the key's 8-byte prefix with
+    np.searchsorted and binary-searches only that range, so a lookup touches a
+    few pages rather than decoding the table.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, prefixes: Optional[np.ndarray] = None):
+        self.data = data
+        self.offsets = offsets
+        if prefixes is None:
+            prefixes = _prefix_keys([self.raw(i) for i in range(len(self))])
+        self.prefixes = prefixes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def find(self, key: str) -> Optional[int]:
+        raw = key.encode("utf-8")
+        prefix = np.array([int.from_bytes(raw[:8].ljust(8, b"\0"), "big")], dtype=">u8")
+        lo = int(np.searchsorted(self.prefixes, prefix, "left")[0])
+        hi = int(np.searchsorted(self.prefixes, prefix, "right")[0])
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self.raw(mid)
+            if cur < raw:
+                lo = mid + 1
+            elif cur > raw:
+                hi = mid
+            else:
+                return mid
+        return None
+
+
+def varint_encode(values: np.ndarray) -> np.ndarray:
+    """LEB128 varints (7 bits per byte, high bit = more bytes follow) of non-negative ints."""
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max()) if len(values) else 0):
+        sel = nbytes > k
+        byte = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(nbytes[sel] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[sel] + k] = byte
+    return out
+
+def varint_decode(buf: np.ndarray) -> np.ndarray:
+    b = np.asarray(buf, dtype=np.uint8)
+    if not len(b):
+        return np.zeros(0, dtype=np.int64)
+    last = b < 0x80
+    group = np.zeros(len(b), dtype=np.int64)
+    group[1:] = np.cumsum(last[:-1])
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    shift = (7 * (np.arange(len(b)) - starts[group])).astype(np.uint64)
+    values = np.zeros(int(last.sum()), dtype=np.uint64)
+    np.add.at(values, group, (b & 0x7F).astype(np.uint64) << shift)
+    return values.astype(np.int64)
+
+
+def write_entity_index(path: Path, index: Dict[str, Iterable[str]]) -> None:
+    """Write entity -> chunk IDs postings (entities lowercased) in the EntityIndex format.
+
+    Layout after the header, every section 8-byte aligned:
+      entity prefixes (>u8), entity offsets (int64), entity UTF-8 bytes,
+      chunk ID offsets (int64), chunk ID UTF-8 bytes,
+      postings offsets (int64), postings: sorted chunk numbers, delta + varint
+    """
+    merged: Dict[str, set] = {}
+    for entity, chunk_ids in index.items():
+        # Positional ints come from indexes built before chunk IDs were stored
+        merged.setdefault(entity.lower(), set()).update(c for c in chunk_ids if isinstance(c, str))
+    entities = sorted(e for e, ids in merged.items() if ids)
+    chunk_ids = sorted(set().union(*merged.values())) if merged else []
+    number = {c: i for i, c in enumerate(chunk_ids)}
+
+    blobs, post_offsets = [], np.zeros(len(entities) + 1, dtype=np.int64)
+    for i, e in enumerate(entities):
+        nums = np.array(sorted(number[c] for c in merged[e]), dtype=np.int64)
+        blob = varint_encode(np.diff(nums, prepend=0))
+        blobs.append(blob)
+        post_offsets[i + 1] = post_offsets[i] + len(blob)
+
+    e_data, e_offsets, e_prefixes = encode_strings(entities)
+    c_data, c_offsets, _ = encode_strings(chunk_ids)
+    sections = [e_prefixes, e_offsets, e_data, c_offsets, c_data, post_offsets,
+                np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8)]
+
+    offsets, pos = [], _HEADER
+    for arr in sections:
+        pos += -pos % 8
+        offsets.append(pos)
+        pos += arr.nbytes
+    header = _MAGIC + np.array([len(entities), len(chunk_ids), *offsets], dtype="<u8").tobytes()
+
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        for off, arr in zip(offsets, sections):
+            f.write(b"\0" * (off - f.tell()))
+            f.write(arr.tobytes())
+    os.replace(tmp, path)
+
+
+class EntityIndex:
+    """Read-only, memory-mapped entity -> chunk IDs postings of one material.
+
+    Opening reads only the header; `postings` decodes a single entity's list.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        buf = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(buf[:len(_MAGIC)]) != _MAGIC:
+            raise ValueError(f"{self.path} is not an entity index")
+        n_entities, n_chunks, *offsets = np.frombuffer(bytes(buf[len(_MAGIC):_HEADER]), dtype="<u8").tolist()
+        ends = offsets[1:] + [len(buf)]
+
+        def section(i: int, dtype, count: int) -> np.ndarray:
+            return buf[offsets[i]:offsets[i] + count * np.dtype(dtype).itemsize].view(dtype)
+
+        self.entities = StringTable(
+            section(2, np.uint8, ends[2] - offsets[2]), section(1, "<i8", n_entities + 1), section(0, ">u8", n_entities)
+        )
+        # Chunk IDs are only read by position, so they need no prefix keys
+        self.chunk_ids = StringTable(section(4, np.uint8, ends[4] - offsets[4]), section(3, "<i8", n_chunks + 1), np.zeros(0, ">u8"))
+        self._post_offsets = section(5, "<i8", n_entities + 1)
+        self._post_data = buf[offsets[6]:]
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def __contains__(self, entity: str) -> bool:
+        return self.entities.find(entity.lower()) is not None
+
+    def postings(self, entity: str) -> List[str]:
+        i = self.entities.find(entity.lower())
+        if i is None:
+            return []
+        s, e = self._post_offsets[i], self._post_offsets[i + 1]
+        nums = np.cumsum(varint_decode(self._post_data[s:e]))
+        if not len(nums):
+            return []
+        # Chunk numbers are sorted: copy the covering byte range once, then slice it
+        starts, ends = self.chunk_ids.offsets[nums], self.chunk_ids.offsets[nums + 1]
+        base = int(starts[0])
+        raw = bytes(self.chunk_ids.data[base:int(ends[-1])])
+        return [raw[a - base:b - base].decode("utf-8") for a, b in zip(starts.tolist(), ends.tolist())]
+
+    def items(self) -> Iterator[Tuple[str, List[str]]]:
+        for entity in self.entities:
+            yield entity, self.postings(entity)
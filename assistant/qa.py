@@ -0,0 +1,377 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+
+from langchain_community.llms import Ollama
+from langchain.prompts import PromptTemplate
+from langchain.schema import Document
+import numpy as np
+from .embeddings import get_embeddings
+from .answers import answer_cache
+from .kg import kg_candidates
+from .lexical import course_lexical_index, reciprocal_rank_fusion
+from .nlp import nlp
+from .rerank import rerank_scores
+from .stores import course_store, index_version
+from .tokens import chunk_tokens
+from typing import Tuple
+import math
+
+logger = logging.getLogger(__name__)
+
+MIN_K = 4                  # always retrieve at least this many (if available)
+MAX_FETCH = 24             # candidate pool size to consider per query
+TOKEN_BUDGET = 1500        # tokens (of OLLAMA_LLM_MODEL's tokenizer) you allow for the context
+RRF_K = 60                 # reciprocal-rank fusion constant for dense + BM25 candidates
+
+def combined_rank_score(doc, base_score: float, query_ents) -> float:
+    # base_score: vector relevance (0..1 usually; if unknown, assume 0.5)
+    ents = set(map(str, doc.metadata.get("entities", [])))
+    overlap = len(ents.intersection(set(query_ents)))
+    # Weighting: tune alpha/beta to your liking
+    alpha = 0.7  # vector similarity
+    beta  = 0.3  # KG entity overlap
+    # Normalize overlap a bit (log to avoid huge jumps)
+    overlap_signal = math.log1p(overlap) / math.log(1 + 8)  # cap ~8 ents
+    return alpha * base_score + beta * overlap_signal
+
+def _embedding():
+    return get_embeddings()
+
+def _llm():
+    return Ollama(model=getattr(settings, "OLLAMA_LLM_MODEL", "llama3"), temperature=0.1)
+
+def extract_query_entities(q: str) -> List[str]:
+    doc = nlp()(q)
+    ents = {e.text for e in doc.ents}
+    ents |= {t.lemma_ for t in doc if t.pos_ in {"NOUN","PROPN"} and len(t) > 2}
+    return list(ents)
+
+def kg_rerank(query_ents: List[str], docs: List[Document]) -> List[Document]:
+    # Simple boost: sort by overlap count with chunk entities metadata
+    def overlap(d: Document) -> int:
+        ents = set(map(str, d.metadata.get("entities", [])))
+        return len(ents.intersection(set(query_ents)))
+    return sorted(docs, key=overlap, reverse=True)
+
+PROMPT = PromptTemplate.from_template(
+    """You are a helpful teaching assistant. Answer the question ONLY using the provided context.
+If you are unsure, say you don't know.
+After your answer, include a short "Sources:" list with (Material Title — p. X) for each cited chunk.
+
+Question: {question}
+
+Context:
+{context}
+
+Answer:"""
+)
+
+def format_context(docs: List[Document]) -> str:
+    blocks = []
+    for d in docs:
+        title = d.metadata.get("material_title", "Unknown")
+        page = d.metadata.get("page", "?")
+        blocks.append(f"[{title} — p.{page}]\n{d.page_content}")
+    return "\n\n---\n\n".join(blocks)
+
+def build_sources(docs: List[Document]) -> List[Dict[str, Any]]:
+    seen = set()
+    out = []
+    for d in docs:
+        key = (d.metadata.get("material_title"), d.metadata.get("page"))
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append({
+            "material_title": d.metadata.get("material_title"),
+            "page": d.metadata.get("page"),
+            "material_id": d.metadata.get("material_id"),
+        })
+    return out
+
+# spaCy is CPU-bound and blocking: keep it off the event loop and off Django's
+# single thread-sensitive sync executor
+_NLP_POOL = ThreadPoolExecutor(
+    max_workers=int(getattr(settings, "ASSISTANT_NLP_THREADS", 2)), thread_name_prefix="assistant-nlp"
+)
+
+async def _aquery_entities(question: str) -> List[str]:
+    return await asyncio.get_running_loop().run_in_executor(_NLP_POOL, extract_query_entities, question)
+
+async def _lookup_cached_answer(course_id: str, question: str, k_cap):
+    """Answer cache: same (or near-identical) question against the same index version."""
+    cache = answer_cache()
+    version = index_version(course_id)
+    q_vec = None
+    if cache.threshold > 0:
+        # Reused for the vector search, so the question is embedded once
+        q_vec = await _embedding().aembed_query(question)
+    cached = cache.get(course_id, version, question, k=k_cap, vec=q_vec)
+    return cached, (course_id, version, question, k_cap, q_vec)
+
+def _store_answer(cache_key, payload: Dict[str, Any]) -> None:
+    course_id, version, question, k_cap, q_vec = cache_key
+    answer_cache().put(course_id, version, question, payload, k=k_cap, vec=q_vec)
+
+def _vector_search(db, course_id: str, q_vec: List[float]) -> Tuple[List[Tuple[Document, float]], Dict[str, List[float]]]:
+    # Query the collection directly: unlike the langchain wrapper it returns chunk IDs
+    # (and the stored embeddings, reused for MMR)
+    res = db._collection.query(
+        query_embeddings=[q_vec], n_results=MAX_FETCH, where={"course_id": course_id},
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    try:
+        # Best: get relevance scores directly (0..1 typically)
+        relevance = db._select_relevance_score_fn()
+    except NotImplementedError:
+        # Assume a neutral base score if not provided
+        relevance = lambda _distance: 0.5
+    docs = [
+        (Document(id=i, page_content=text, metadata=meta or {}), relevance(distance))
+        for i, text, meta, distance in zip(res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0])
+    ]
+    embeddings = res.get("embeddings")
+    vectors = dict(zip(res["ids"][0], embeddings[0])) if embeddings is not None else {}
+    return docs, vectors
+
+def _hybrid_search(course_id: str, question: str, q_vec: List[float], q_ents: List[str]):
+    """Dense, BM25 and KG-expansion candidates fused with reciprocal-rank fusion.
+
+    The fused score is scaled to 0..1 so it can stand in for the vector score in
+    combined_rank_score. Candidates missing from the dense results are fetched
+    from Chroma by ID. Returns ((doc, score) pairs, chunk ID -> stored embedding).
+    """
+    db = course_store(course_id)
+    dense, vectors = _vector_search(db, course_id, q_vec)
+    lexical = [cid for cid, _ in course_lexical_index(course_id).search(question, k=MAX_FETCH)]
+    graph = kg_candidates(course_id, q_ents, k=MAX_FETCH)
+    if not lexical and not graph:
+        return dense, vectors
+
+    docs = {d.id: d for d, _ in dense}
+    rankings = [r for r in ([d.id for d, _ in dense], lexical, graph) if r]
+    fused = reciprocal_rank_fusion(rankings, k=RRF_K)
+    top = sorted(fused, key=fused.get, reverse=True)[:MAX_FETCH]
+    missing = [cid for cid in top if cid not in docs]
+    if missing:
+        got = db.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        embeddings = got.get("embeddings")
+        if embeddings is None:
+            embeddings = [None] * len(got["ids"])
+        for i, text, meta, vec in zip(got["ids"], got["documents"], got["metadatas"], embeddings):
+            docs[i] = Document(id=i, page_content=text, metadata=meta or {})
+            if vec is not None:
+                vectors[i] = vec
+    best = len(rankings) / (RRF_K + 1)  # rank 1 in every list
+    return [(docs[cid], fused[cid] / best) for cid in top if cid in docs], vectors
+
+def rank_candidates(question: str, docs_with_scores: List[Tuple[Document, float]], q_ents: List[str]) -> Tuple[List[Tuple[Document, float]], bool]:
+    """Order candidates by the configured reranker, else by combined_rank_score.
+    Returns (ranked (doc, score) pairs, whether the reranker was used)."""
+    scores = rerank_scores(question, [d.page_content for d, _ in docs_with_scores])
+    # Fallback: vector score + KG overlap
+    fallback = sorted(((d, combined_rank_score(d, s, q_ents)) for d, s in docs_with_scores[len(scores or ()):]),
+                      key=lambda t: t[1], reverse=True)
+    if scores is None:
+        return fallback, False
+    reranked = sorted(zip((d for d, _ in docs_with_scores), scores), key=lambda t: t[1], reverse=True)
+    # Candidates the reranker had no time for go last, in fallback order
+    floor = min(scores) - 1.0
+    return reranked + [(d, floor) for d, _ in fallback], True
+
+def mmr_order(ranked: List[Tuple[Document, float]], vectors: Dict[str, List[float]], lam: float = 0.7) -> List[Tuple[Document, float]]:
+    """Maximal marginal relevance: greedily re-order candidates by
+    lam * relevance - (1 - lam) * (max cosine similarity to those already picked).
+    Relevance is the rank score rescaled to 0..1; candidates without a stored
+    embedding are never penalized. Returns (doc, MMR score at pick time)."""
+    if len(ranked) < 2:
+        return ranked
+    scores = np.array([s for _, s in ranked], dtype=np.float32)
+    rel = (scores - scores.min()) / ((scores.max() - scores.min()) or 1.0)
+    dim = next((len(v) for v in vectors.values()), 0)
+    V = np.zeros((len(ranked), dim), dtype=np.float32)
+    for i, (d, _) in enumerate(ranked):
+        if d.id in vectors:
+            V[i] = vectors[d.id]
+    norms = np.linalg.norm(V, axis=1, keepdims=True)
+    V = np.divide(V, norms, out=np.zeros_like(V), where=norms > 0)
+    sim = V @ V.T
+
+    picked: List[Tuple[Document, float]] = []
+    max_sim = np.zeros(len(ranked), dtype=np.float32)
+    left = np.ones(len(ranked), dtype=bool)
+    for _ in range(len(ranked)):
+        mmr = np.where(left, lam * rel - (1 - lam) * max_sim, -np.inf)
+        i = int(np.argmax(mmr))
+        picked.append((ranked[i][0], float(mmr[i])))
+        left[i] = False
+        max_sim = np.maximum(max_sim, sim[i])
+    return picked
+
+def _overlap(a: str, b: str, min_len: int = 20, window: int = 400) -> int:
+    """Length of the longest suffix of `a` (within `window` chars) that `b` starts with."""
+    tail = a[-window:]
+    head = b[:min_len]
+    if len(head) < min_len:
+        return 0
+    pos = tail.find(head)
+    while pos != -1:
+        if b.startswith(tail[pos:]):
+            return len(tail) - pos
+        pos = tail.find(head, pos + 1)
+    return 0
+
+def merge_adjacent(docs: List[Document]) -> List[Document]:
+    """Join chunks of the same material page whose texts overlap (the splitter's
+    chunk_overlap) into one span, so the shared text is sent to the LLM once.
+    A merged span takes the position of its best-ranked chunk."""
+    spans: List[Document] = []
+    for d in docs:
+        key = (d.metadata.get("material_id"), d.metadata.get("page"))
+        text = d.page_content
+        for i, span in enumerate(spans):
+            if (span.metadata.get("material_id"), span.metadata.get("page")) != key:
+                continue
+            if n := _overlap(span.page_content, text):
+                text = span.page_content + text[n:]
+            elif n := _overlap(text, span.page_content):
+                text = text + span.page_content[n:]
+            else:
+                continue
+            spans[i] = Document(id=span.id, page_content=text, metadata=span.metadata)
+            break
+        else:
+            spans.append(d)
+    # A new chunk can bridge two spans that did not overlap before
+    if len(spans) < len(docs):
+        return merge_adjacent(spans)
+    return spans
+
+def pack_context(tokens: List[int], values: List[float], budget: int, max_items: int) -> List[int]:
+    """0/1 knapsack: indices of the items with the highest total value whose
+    tokens fit in `budget`, using at most `max_items` items."""
+    n, slots = len(tokens), min(max_items, len(tokens))
+    if budget < 0 or slots <= 0:
+        return []
+    # best[c, b]: highest value using c items and at most b tokens
+    best = np.full((slots + 1, budget + 1), -np.inf)
+    best[0, :] = 0.0
+    take = np.zeros((n, slots + 1, budget + 1), dtype=bool)
+    for i, (w, v) in enumerate(zip(tokens, values)):
+        if w > budget:
+            continue
+        for c in range(min(i + 1, slots), 0, -1):
+            cand = best[c - 1, :budget + 1 - w] + v
+            better = cand > best[c, w:]
+            best[c, w:][better] = cand[better]
+            take[i, c, w:][better] = True
+    c, b = np.unravel_index(int(np.argmax(best)), best.shape)
+    chosen = []
+    for i in range(n - 1, -1, -1):
+        if c > 0 and take[i, c, b]:
+            chosen.append(i)
+            c, b = c - 1, b - tokens[i]
+    return sorted(chosen)
+
+def select_context(ranked: List[Tuple[Document, float]], k_cap) -> List[Document]:
+    # Pack into the token budget: the top MIN_K always go in, the rest are
+    # chosen to maximize their total (rerank) score within what is left
+    if not ranked:
+        return []
+    forced = ranked[:min(MIN_K, k_cap or MIN_K)]
+    rest = ranked[len(forced):]
+    used = sum(chunk_tokens(d.page_content, d.metadata) for d, _ in forced)
+    slots = (k_cap - len(forced)) if k_cap is not None else len(rest)
+    if not rest or slots <= 0 or used >= TOKEN_BUDGET:
+        return [d for d, _ in forced]
+
+    scores = [s for _, s in ranked]
+    lo, span = min(scores), (max(scores) - min(scores)) or 1.0
+    # Rescaled to (0, 1] so every chunk that fits adds value; order is kept
+    values = [0.01 + (s - lo) / span for _, s in rest]
+    tokens = [chunk_tokens(d.page_content, d.metadata) for d, _ in rest]
+    picked = pack_context(tokens, values, TOKEN_BUDGET - used, slots)
+    return [d for d, _ in forced] + [rest[i][0] for i in picked]
+
+def _diversify_and_pack(ranked: List[Tuple[Document, float]], vectors: Dict[str, List[float]], k_cap) -> List[Document]:
+    # MMR, token counting and the knapsack are CPU work: run on a worker thread
+    ranked = mmr_order(ranked, vectors, float(getattr(settings, "ASSISTANT_MMR_LAMBDA", 0.7)))
+    return select_context(ranked, k_cap)
+
+async def retrieve_context(course_id: str, question: str, k_cap, q_vec=None) -> Tuple[List[Document], List[str]]:
+    """Hybrid (dense + BM25 + KG expansion) search + re-rank + MMR + token-budget packing.
+    Returns (selected docs, query entities); overlapping chunks of one page come back merged.
+
+    Query embedding (async HTTP) and spaCy parsing (thread pool) run concurrently;
+    the local Chroma/BM25 search, reranking and context packing run on worker threads.
+    """
+    # 2) Retrieve a larger candidate pool with scores
+    ents_task = asyncio.ensure_future(_aquery_entities(question))
+    try:
+        if q_vec is None:
+            q_vec = await _embedding().aembed_query(question)
+        q_ents = await ents_task
+    finally:
+        # Embedding failed: don't leave the entity task (and its exception) dangling
+        if not ents_task.done():
+            ents_task.cancel()
+    docs_with_scores, vectors = await sync_to_async(_hybrid_search, thread_sensitive=False)(course_id, question, q_vec, q_ents)
+    # 3) Re-rank; the cross-encoder is precise enough to send fewer chunks to the LLM
+    ranked, reranked = await sync_to_async(rank_candidates, thread_sensitive=False)(question, docs_with_scores, q_ents)
+    if reranked:
+        rerank_k = int(getattr(settings, "ASSISTANT_RERANK_CONTEXT_K", 6))
+        k_cap = min(k_cap, rerank_k) if k_cap else rerank_k
+    # 4) Penalize near-duplicates (MMR), pack into the budget, join overlapping neighbours
+    selected = await sync_to_async(_diversify_and_pack, thread_sensitive=False)(ranked, vectors, k_cap)
+    return merge_adjacent(selected), q_ents
+
+async def answer(course_id: str, question: str, k_cap) -> Dict[str, Any]:
+    """Answer from the cache ("cached": True) or by retrieval + generation; fresh answers are cached."""
+    # 1) Answer cache
+    cached, cache_key = await _lookup_cached_answer(course_id, question, k_cap)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    # 2-4) Retrieve, re-rank, trim
+    selected_docs, q_ents = await retrieve_context(course_id, question, k_cap, q_vec=cache_key[-1])
+
+    # 5) Compose and call LLM
+    prompt = PROMPT.format(question=question, context=format_context(selected_docs))
+    text = await _llm().ainvoke(prompt)
+
+    payload = {
+        "answer": text.strip(),
+        "sources": build_sources(selected_docs),
+        "used_entities": q_ents,
+    }
+    _store_answer(cache_key, payload)
+    return payload
+
+async def stream_answer(course_id: str, question: str, k_cap) -> AsyncIterator[Tuple[str, Any]]:
+    """Streaming `answer`: yields ("sources", {...}) as soon as retrieval is done,
+    then ("token", text) per generated chunk, then ("done", {})."""
+    cached, cache_key = await _lookup_cached_answer(course_id, question, k_cap)
+    if cached is not None:
+        yield "sources", {"sources": cached["sources"], "used_entities": cached["used_entities"], "cached": True}
+        yield "token", cached["answer"]
+        yield "done", {}
+        return
+
+    selected_docs, q_ents = await retrieve_context(course_id, question, k_cap, q_vec=cache_key[-1])
+    sources = build_sources(selected_docs)
+    yield "sources", {"sources": sources, "used_entities": q_ents}
+
+    prompt = PROMPT.format(question=question, context=format_context(selected_docs))
+    parts = []
+    async for token in _llm().astream(prompt):
+        parts.append(token)
+        yield "token", token
+
+    _store_answer(cache_key, {"answer": "".join(parts).strip(), "sources": sources, "used_entities": q_ents})
+    yield "done", {}
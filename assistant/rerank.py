@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a sentence-transformers cross-encoder on CPU.
+
+    Optional: the model is downloaded from the Hugging Face Hub on first load
+    unless already cached, so it is off unless ASSISTANT_RERANKER names it. The model is loaded once, in a background
+    thread; until it is ready (or if loading failed) `score` returns None and
+    callers keep their own ranking. Pairs are scored in batches, best candidates
+    first; at the deadline the scores of the batches that finished are returned.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_length: int = 512, concurrency: int = 2):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self._failed = False
+        self._loader: Optional[threading.Thread] = None
+        self._loaded = threading.Event()
+        self._lock = threading.Lock()
+        # Bounded concurrent passes: more only contend for the same cores
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+
+    def _load(self) -> None:
+        try:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+        except Exception as e:
+            self._failed = True
+            logger.warning("Reranker %s unavailable, using combined_rank_score: %s", self.model_name, e)
+        finally:
+            self._loaded.set()
+
+    def ready(self, block: bool = False) -> bool:
+        if not self._loaded.is_set():
+            with self._lock:
+                if self._loader is None:
+                    self._loader = threading.Thread(target=self._load, name="reranker-load", daemon=True)
+                    self._loader.start()
+            if not block:
+                return False
+            self._loaded.wait()
+        return self._model is not None
+
+    def score(self, question: str, texts: List[str], deadline: Optional[float] = None) -> Optional[List[float]]:
+        """Scores for texts[:n], n <= len(texts); None if not even one batch finished in time."""
+        if not texts or not self.ready():
+            return None
+        timeout = -1 if deadline is None else max(0.0, deadline - time.perf_counter())
+        if not self._slots.acquire(timeout=timeout):
+            return None
+        try:
+            scores: List[float] = []
+            for i in range(0, len(texts), self.batch_size):
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+                pairs = [(question, t) for t in texts[i:i + self.batch_size]]
+                scores.extend(float(s) for s in self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False))
+            return scores or None
+        finally:
+            self._slots.release()
+
+
+_RERANKER = None
+_RERANKER_LOCK = threading.Lock()
+
+def get_reranker():
+    """Reranker configured by ASSISTANT_RERANKER (dotted path, "" disables), built once per process."""
+    global _RERANKER
+    if _RERANKER is None:
+        with _RERANKER_LOCK:
+            if _RERANKER is None:
+                path = getattr(settings, "ASSISTANT_RERANKER", "")
+                if not path:
+                    _RERANKER = False
+                else:
+                    _RERANKER = import_string(path)(
+                        getattr(settings, "ASSISTANT_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                        batch_size=int(getattr(settings, "ASSISTANT_RERANK_BATCH_SIZE", 16)),
+                        concurrency=int(getattr(settings, "ASSISTANT_RERANK_CONCURRENCY", 2)),
+                    )
+    return _RERANKER or None
+
+def rerank_scores(question: str, texts: List[str]) -> Optional[List[float]]:
+    """Relevance scores for a prefix of texts (those scored within
+    ASSISTANT_RERANK_BUDGET_MS), or None when no reranker is configured/ready."""
+    reranker = get_reranker()
+    if reranker is None:
+        return None
+    deadline = time.perf_counter() + float(getattr(settings, "ASSISTANT_RERANK_BUDGET_MS", 300)) / 1000
+    try:
+        return reranker.score(question, texts, deadline=deadline)
+    except Exception as e:
+        logger.exception("Reranking failed: %s", e)
+        return None
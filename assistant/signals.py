@@ -1,29 +1,45 @@
 import logging
-import threading
-from django.db import transaction
+from pathlib import Path
+
+from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 
 from courses.models import CourseMaterial  # adjust import path to your app
-from .pipeline import process_material
+from .jobs import enqueue_material, enqueue_removal
 
 logger = logging.getLogger(__name__)
 
+@receiver(pre_save, sender=CourseMaterial)
+def remember_upload_change(sender, instance: CourseMaterial, **kwargs):
+    if not instance.pk:
+        return
+    old = CourseMaterial.objects.filter(pk=instance.pk).values_list("upload", flat=True).first()
+    instance._upload_changed = old != instance.upload.name
+
 @receiver(post_save, sender=CourseMaterial)
 def build_indexes_on_create(sender, instance: CourseMaterial, created, **kwargs):
-    if not created:
+    # Index new materials, and re-index (incrementally) when the file is replaced
+    if not created and not getattr(instance, "_upload_changed", False):
         return
     if instance.material_type != CourseMaterial.PDF:
         return
     if not instance.upload:
         return
 
-    def _run():
-        try:
-            process_material(instance)
-            logger.info("Indexed material %s (id=%s)", instance.title, instance.id)
-        except Exception as e:
-            logger.exception("Indexing failed for material %s: %s", instance.id, e)
+    # Persisted in the same transaction as the material; `manage.py run_index_workers`
+    # picks it up once committed, so a restart never loses the job.
+    job = enqueue_material(instance)
+    logger.info("Queued indexing job %s for material %s", job.id, instance.id)
 
-    # Ensure file is committed to storage before processing
-    transaction.on_commit(lambda: threading.Thread(target=_run, daemon=True).start())
+@receiver(post_delete, sender=CourseMaterial)
+def drop_indexes_on_delete(sender, instance: CourseMaterial, **kwargs):
+    # Only PDFs are indexed. A removal opens the course store, rewrites the KG and
+    # bumps the index version (dropping every cache): skip materials with no index
+    indexed = (Path(settings.AI_DB_DIR) / str(instance.course_id) / str(instance.id)).exists()
+    if instance.material_type != CourseMaterial.PDF and not indexed:
+        return
+    # Dropping vectors and rewriting the course KG is slow: leave it to
+    # `manage.py run_index_workers`, committed together with the delete.
+    job = enqueue_removal(instance.course_id, instance.id)
+    logger.info("Queued removal job %s for material %s", job.id, instance.id)
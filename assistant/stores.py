@@ -0,0 +1,93 @@
+import fcntl
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Tuple
+
+from django.conf import settings
+from langchain_community.vectorstores import Chroma
+
+from .embeddings import get_embeddings
+
+
+def course_dir(course_id) -> Path:
+    return Path(settings.AI_DB_DIR) / str(course_id)
+
+def index_version(course_id) -> int:
+    """Current index version of a course; bumped by ingestion on every write."""
+    try:
+        return int((course_dir(course_id) / "index_version").read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def bump_index_version(course_id) -> int:
+    path = course_dir(course_id) / "index_version"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Index workers (threads or processes) may bump the same course at once:
+    # serialize the read-modify-write, and give every writer its own temp file
+    with open(path.with_name(".index_version.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            version = index_version(course_id) + 1
+            tmp = path.with_name(f"index_version.{uuid.uuid4().hex}.tmp")
+            tmp.write_text(str(version))
+            os.replace(tmp, path)  # atomic, readers never see a partial file
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return version
+
+
+class VectorStoreRegistry:
+    """Process-wide cache of open Chroma handles, one per course.
+
+    A handle is reopened when the course's index version changes (ingestion may
+    run in another process) and closed after `idle_seconds` without use.
+    """
+
+    def __init__(self, idle_seconds: float = 900):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        # course_id -> (store, index version it was opened at, last used)
+        self._stores: Dict[str, Tuple[Chroma, int, float]] = {}
+
+    def _open(self, course_id: str) -> Chroma:
+        return Chroma(persist_directory=str(course_dir(course_id)), embedding_function=get_embeddings())
+
+    def get(self, course_id) -> Chroma:
+        course_id = str(course_id)
+        version = index_version(course_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._stores.get(course_id)
+            if entry is not None and entry[1] == version:
+                self._stores[course_id] = (entry[0], version, now)
+                return entry[0]
+            store = self._open(course_id)
+            self._stores[course_id] = (store, version, now)
+            return store
+
+    def invalidate(self, course_id) -> None:
+        with self._lock:
+            self._stores.pop(str(course_id), None)
+
+    def _evict_idle(self, now: float) -> None:
+        for cid, (_store, _version, used) in list(self._stores.items()):
+            if now - used > self.idle_seconds:
+                del self._stores[cid]
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+
+_REGISTRY = VectorStoreRegistry(float(getattr(settings, "ASSISTANT_STORE_IDLE_SECONDS", 900)))
+
+def course_store(course_id) -> Chroma:
+    return _REGISTRY.get(course_id)
+
+def invalidate_course_store(course_id) -> None:
+    """Drop the cached handle in this process and make other processes reopen theirs."""
+    _REGISTRY.invalidate(course_id)
+    bump_index_version(course_id)
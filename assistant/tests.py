@@ -1,3 +1,357 @@
-from django.test import TestCase
+import itertools
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from langchain.schema import Document
+
+from courses.models import Course, CourseMaterial
+from users.models import Professor
+
+import numpy as np
+from scipy import sparse
+
+from .embeddings import EmbeddingCache
+from .jobs import claim_next, requeue_stale, run_job
+from .kg import CooccurrenceBuilder, CourseKG
+from .models import IndexingJob
+from .postings import EntityIndex, varint_decode, varint_encode, write_entity_index
+from .qa import merge_adjacent, mmr_order, pack_context
+from .stores import bump_index_version, index_version
+
+
+class IndexingJobClaimTests(TestCase):
+    def setUp(self):
+        prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        course = Course.objects.create(name="Algebra", description="", credits=5, instructor=prof)
+        self.jobs = [
+            IndexingJob.objects.create(
+                material=CourseMaterial.objects.create(course=course, title=f"m{i}", material_type=CourseMaterial.LINK),
+                max_attempts=2,
+            )
+            for i in range(3)
+        ]
+
+    @override_settings(ASSISTANT_INDEX_MAX_RUNNING=2)
+    def test_claim_respects_running_limit_and_counts_attempt(self):
+        first, second, third = (claim_next("w") for _ in range(3))
+        self.assertEqual([first.pk, second.pk], [self.jobs[0].pk, self.jobs[1].pk])
+        self.assertIsNone(third)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(IndexingJob.objects.filter(status=IndexingJob.RUNNING).count(), 2)
+
+    def test_stale_job_out_of_attempts_fails_instead_of_requeueing(self):
+        job = claim_next("w")
+        IndexingJob.objects.filter(pk=job.pk).update(attempts=2, started_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(IndexingJob.objects.get(pk=job.pk).status, IndexingJob.FAILED)
+
+    def test_run_job_tolerates_material_deleted_while_running(self):
+        job = claim_next("w")
+
+        def index_then_delete(material):
+            material.delete()  # cascades to the job row
+
+        with mock.patch("assistant.pipeline.process_material", side_effect=index_then_delete):
+            run_job(job)
+        self.assertFalse(IndexingJob.objects.filter(pk=job.pk).exists())
+
+    def test_deleting_pdf_queues_removal_job(self):
+        material = CourseMaterial.objects.create(course=self.jobs[0].material.course, title="notes",
+                                                 material_type=CourseMaterial.PDF)
+        course_id, material_id = material.course_id, material.pk
+        material.delete()
+        job = IndexingJob.objects.get(action=IndexingJob.REMOVE)
+        self.assertEqual((job.course_id, job.removed_material_id, job.status),
+                         (course_id, material_id, IndexingJob.PENDING))
+
+    def test_deleting_unindexed_link_queues_nothing(self):
+        self.jobs[0].material.delete()
+        self.assertFalse(IndexingJob.objects.filter(action=IndexingJob.REMOVE).exists())
+
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = EmbeddingCache(Path(tmp.name) / "cache.sqlite3", max_entries=10)
+        self.addCleanup(self.cache._conn.close)
+
+    def test_reads_do_not_write_until_next_put(self):
+        self.cache.put_many({"a": [1.0, 2.0], "b": [3.0]})
+        writes = self.cache._conn.total_changes
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": [1.0, 2.0], "b": [3.0]})
+        self.assertEqual(self.cache._conn.total_changes, writes)
+        self.cache.put_many({"c": [4.0]})
+        # the two pending last_used touches were written with the insert
+        self.assertEqual(self.cache._conn.total_changes, writes + 3)
+
+
+class CooccurrenceBuilderTests(TestCase):
+    def test_edges_match_pairwise_counts(self):
+        rng = random.Random(5)
+        names = [f"concept{i}" for i in range(30)]
+        chunks = [sorted(rng.sample(names, rng.randint(0, 6))) for _ in range(50)]
+        expected = {}
+        for ents in chunks:
+            for pair in itertools.combinations(ents, 2):
+                expected[pair] = expected.get(pair, 0) + 1
+
+        # A small block so the counts are folded across several flushes
+        kg = CooccurrenceBuilder(block=7)
+        for i, ents in enumerate(chunks):
+            kg.add(i, ents)
+        strings, u, v, w = kg.edges()
+        got = {tuple(sorted((a, b))): c for a, b, c in zip(strings[u].tolist(), strings[v].tolist(), w.tolist())}
+        self.assertEqual(got, expected)
+        self.assertEqual(kg.index[chunks[0][0]][0], 0)
+
+
+class CourseKGGenerationTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(AI_DB_DIR=tmp.name))
+
+    def test_save_keeps_previous_generation_until_next_swap(self):
+        strings = np.array(["algebra", "matrix"])
+        kg = CourseKG.from_arrays(strings, sparse.csr_matrix(np.array([[0, 2], [2, 0]])))
+        for _ in range(3):
+            kg.save(1)
+        generations = {p.name.split(".")[1] for p in CourseKG.directory(1).glob("*.*.*")}
+        self.assertEqual(generations, {"2", "3"})
+        self.assertEqual(CourseKG.open(1).neighbors("Matrix"), [("algebra", 2.0)])
+
+
+class PackContextTests(TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            n = rng.randint(1, 7)
+            tokens = [rng.randint(1, 40) for _ in range(n)]
+            values = [rng.uniform(0.01, 1.0) for _ in range(n)]
+            budget, max_items = rng.randint(0, 100), rng.randint(1, n)
+            best = max(
+                (sum(values[i] for i in combo)
+                 for r in range(max_items + 1) for combo in itertools.combinations(range(n), r)
+                 if sum(tokens[i] for i in combo) <= budget),
+            )
+            picked = pack_context(tokens, values, budget, max_items)
+            self.assertEqual(picked, sorted(set(picked)))
+            self.assertLessEqual(len(picked), max_items)
+            self.assertLessEqual(sum(tokens[i] for i in picked), budget)
+            self.assertAlmostEqual(sum(values[i] for i in picked), best)
+
+    def test_nothing_fits(self):
+        self.assertEqual(pack_context([50, 60], [1.0, 2.0], 10, 2), [])
+        self.assertEqual(pack_context([5], [1.0], -1, 1), [])
+
+
+class MergeAdjacentTests(TestCase):
+    def setUp(self):
+        from .pipeline import iter_chunks
+
+        rng = random.Random(3)
+        words = "matrix vector eigenvalue space inner product basis rank kernel image linear map".split()
+        self.text = " ".join(" ".join(rng.choice(words) for _ in range(12)) + "." for _ in range(60))
+        self.chunks = [
+            Document(id=str(c["idx"]), page_content=c["text"], metadata={"material_id": "5", "page": c["page"]})
+            for c in iter_chunks([(1, self.text)])
+        ]
+
+    def test_shuffled_chunks_merge_back_into_page(self):
+        self.assertGreater(len(self.chunks), 3)
+        docs = self.chunks[:]
+        random.Random(1).shuffle(docs)
+        merged = merge_adjacent(docs)
+        self.assertEqual([(d.id, d.page_content) for d in merged], [(docs[0].id, self.text)])
+
+    def test_non_overlapping_chunks_stay_separate(self):
+        first, third = self.chunks[0], self.chunks[2]
+        other_page = Document(id="x", page_content=self.chunks[1].page_content, metadata={"material_id": "5", "page": 2})
+        merged = merge_adjacent([third, first, other_page])
+        self.assertEqual([d.page_content for d in merged], [third.page_content, first.page_content, other_page.page_content])
+
+    def test_bridging_chunk_merges_two_spans(self):
+        merged = merge_adjacent([self.chunks[2], self.chunks[0], self.chunks[1]])
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0].id, self.chunks[2].id)
+        self.assertTrue(self.text.startswith(merged[0].page_content))
+        self.assertTrue(merged[0].page_content.endswith(self.chunks[2].page_content))
+
+
+class MmrOrderTests(TestCase):
+    def setUp(self):
+        self.ranked = [(Document(id=i, page_content=i), s) for i, s in (("a", 1.0), ("b", 0.9), ("c", 0.8))]
+
+    def test_near_duplicate_is_demoted(self):
+        vectors = {"a": [1.0, 0.0], "b": [2.0, 0.0], "c": [0.0, 1.0]}
+        self.assertEqual([d.id for d, _ in mmr_order(self.ranked, vectors, lam=0.5)], ["a", "c", "b"])
+        self.assertEqual([d.id for d, _ in mmr_order(self.ranked, vectors, lam=1.0)], ["a", "b", "c"])
+
+    def test_missing_vector_is_not_penalized(self):
+        vectors = {"a": [1.0, 0.0], "c": [0.0, 1.0]}
+        self.assertEqual([d.id for d, _ in mmr_order(self.ranked, vectors, lam=0.5)], ["a", "b", "c"])
+
+
+class PostingsTests(TestCase):
+    def test_varint_round_trip(self):
+        values = np.array([0, 1, 127, 128, 300, 2 ** 14 - 1, 2 ** 14, 2 ** 35 + 5, 2 ** 62], dtype=np.int64)
+        encoded = varint_encode(values)
+        self.assertEqual(varint_encode([300]).tolist(), [0xAC, 0x02])
+        self.assertEqual(len(encoded), 1 + 1 + 1 + 2 + 2 + 2 + 3 + 6 + 9)
+        np.testing.assert_array_equal(varint_decode(encoded), values)
+        self.assertEqual(len(varint_decode(varint_encode(np.zeros(0, dtype=np.int64)))), 0)
+
+    def test_entity_index_round_trip(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "entities.bin"
+        write_entity_index(path, {
+            "Matrix": ["c2", "c10"],
+            "matrix": ["c1", 3],  # case variants merge; positional ints are dropped
+            "eigenvalue decomposition": ["c2"],
+            "eigenvalue problem": ["c3"],  # shares the 8-byte prefix with the one above
+            "Gauß": ["c1"],
+            "stale": [0, 1],
+        })
+        index = EntityIndex(path)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.postings("MATRIX"), ["c1", "c10", "c2"])
+        self.assertEqual(index.postings("eigenvalue decomposition"), ["c2"])
+        self.assertEqual(index.postings("eigenvalue problem"), ["c3"])
+        self.assertEqual(index.postings("gauß"), ["c1"])
+        self.assertNotIn("stale", index)
+        self.assertEqual(index.postings("eigen"), [])
+
+
+class IndexVersionTests(TestCase):
+    def test_concurrent_bumps_are_not_lost(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        errors = []
+
+        def bump():
+            try:
+                for _ in range(100):
+                    bump_index_version(1)
+            except Exception as e:
+                errors.append(e)
+
+        with override_settings(AI_DB_DIR=tmp.name):
+            threads = [threading.Thread(target=bump) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual((errors, index_version(1)), ([], 300))
+
+
+class ChunkTokenCountTests(TestCase):
+    def test_estimated_counts_are_not_tagged_as_exact(self):
+        from . import tokens
+        from .pipeline import _chunk_metadata, _count_chunk_tokens
+
+        chunks = [{"text": "eigenvalues of a matrix", "page": 1}]
+        with mock.patch.object(tokens, "_TOKENIZER", False):
+            _count_chunk_tokens(chunks)
+        meta = _chunk_metadata(1, 2, "notes", chunks[0])
+        self.assertEqual(meta["token_model"], "")
+        with mock.patch.object(tokens, "count_tokens", return_value=4) as count:
+            self.assertEqual(tokens.chunk_tokens(chunks[0]["text"], meta), 4)
+        count.assert_called_once()
+
+        fake = mock.Mock()
+        fake.encode_batch.return_value = [mock.Mock(ids=[1, 2, 3, 4])]
+        exact = [{"text": "eigenvalues of a matrix", "page": 1}]
+        with mock.patch.object(tokens, "_TOKENIZER", fake):
+            _count_chunk_tokens(exact)
+        self.assertEqual((exact[0]["tokens"], exact[0]["token_model"]), (4, tokens.token_model()))
+
+
+class _FakeStore:
+    """The slice of the Chroma API the pipeline uses, keeping metadata in a dict."""
+
+    def __init__(self):
+        self.rows, self.added, self.deleted = {}, [], []
+        self._collection = self
+
+    def get(self, where, include):
+        ids = [i for i, m in self.rows.items() if m["material_id"] == where["material_id"]]
+        return {"ids": ids, "metadatas": [self.rows[i] for i in ids]}
+
+    def add_texts(self, texts, metadatas, ids):
+        self.added.extend(ids)
+        self.rows.update(zip(ids, metadatas))
+
+    def update(self, ids, metadatas):
+        self.rows.update(zip(ids, metadatas))
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for i in ids:
+            del self.rows[i]
+
+    def persist(self):
+        pass
+
+
+class IncrementalReindexTests(TestCase):
+    def setUp(self):
+        from . import pipeline, tokens
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(AI_DB_DIR=tmp.name))
+        prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        course = Course.objects.create(name="Algebra", description="", credits=5, instructor=prof)
+        self.material = CourseMaterial.objects.create(course=course, title="notes", material_type=CourseMaterial.PDF,
+                                                      upload="notes.pdf")
+        self.store = _FakeStore()
+        self.pages = [(1, "Vectors and spaces."), (2, "Eigenvalues of a matrix."), (3, "Inner products.")]
+
+        def annotate(chunks):
+            for c in chunks:
+                c.setdefault("entities", c["text"].lower().rstrip(".").split()[:2])
+                yield c
+
+        tokenizer = mock.Mock()
+        tokenizer.encode_batch.side_effect = lambda texts, **kw: [mock.Mock(ids=t.split()) for t in texts]
+        self.enterContext(mock.patch.object(tokens, "_TOKENIZER", tokenizer))
+        self.enterContext(mock.patch.object(pipeline, "iter_pages", lambda path: iter(self.pages)))
+        self.enterContext(mock.patch.object(pipeline, "annotate_entities", annotate))
+        self.enterContext(mock.patch.object(pipeline, "_course_store", lambda *a: self.store))
+        self.enterContext(mock.patch.object(pipeline, "embedding_cache"))
+
+    def test_reindex_embeds_changed_chunk_and_deletes_stale_one(self):
+        from .pipeline import process_material
+
+        process_material(self.material)
+        first = set(self.store.rows)
+        self.assertEqual(len(self.store.added), 3)
+
+        self.pages[1] = (2, "Eigenvectors of a matrix.")
+        self.store.added.clear()
+        process_material(self.material)
+        self.assertEqual(len(self.store.added), 1)
+        self.assertEqual(len(self.store.deleted), 1)
+        self.assertIn(self.store.deleted[0], first)
+        self.assertEqual(len(self.store.rows), 3)
+        self.assertEqual(first - set(self.store.rows), set(self.store.deleted))
+
+    def test_moved_chunk_keeps_vector_and_gets_new_page(self):
+        from .pipeline import process_material
+
+        process_material(self.material)
+        self.store.added.clear()
+        self.pages.insert(0, self.pages.pop())
+        self.pages[:] = [(n + 1, text) for n, (_, text) in enumerate(self.pages)]
+        process_material(self.material)
+        self.assertEqual((self.store.added, self.store.deleted), ([], []))
+        pages = {m["page"] for m in self.store.rows.values() if m["entities"] == ["inner", "products"]}
+        self.assertEqual(pages, {1})
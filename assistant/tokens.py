@@ -0,0 +1,90 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TOKENS_PER_CHAR = 0.25     # fallback heuristic when no tokenizer is available: 4 chars ≈ 1 token
+
+# Hugging Face tokenizer repo per Ollama model family (the part before ":")
+DEFAULT_TOKENIZERS = {
+    "llama3": "NousResearch/Meta-Llama-3-8B-Instruct",
+    "llama3.1": "NousResearch/Meta-Llama-3.1-8B-Instruct",
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.3",
+}
+
+_TOKENIZER = None
+_TOKENIZER_LOCK = threading.Lock()
+_LOADER: Optional[threading.Thread] = None
+
+
+def token_model() -> str:
+    """Name stored next to precomputed counts, so a model change invalidates them."""
+    return getattr(settings, "OLLAMA_LLM_MODEL", "llama3")
+
+def exact_token_model() -> str:
+    """token_model() if counts are exact here, "" if they are length estimates
+    (stored with the counts, so estimates get recounted once a tokenizer is available)."""
+    return token_model() if load_tokenizer() else ""
+
+def load_tokenizer():
+    """Tokenizer of OLLAMA_LLM_MODEL, loaded once per process; False if unavailable.
+
+    May download from the Hugging Face Hub: call it from warm-up or workers,
+    not from a request.
+    """
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        with _TOKENIZER_LOCK:
+            if _TOKENIZER is None:
+                model = token_model()
+                mapping = {**DEFAULT_TOKENIZERS, **getattr(settings, "ASSISTANT_TOKENIZERS", {})}
+                repo = mapping.get(model, mapping.get(model.split(":")[0]))
+                try:
+                    if not repo:
+                        raise LookupError(f"no tokenizer configured for {model}")
+                    from tokenizers import Tokenizer
+                    _TOKENIZER = Tokenizer.from_pretrained(repo)
+                except Exception as e:
+                    logger.warning("Tokenizer for %s unavailable, estimating tokens from length: %s", model, e)
+                    _TOKENIZER = False
+    return _TOKENIZER
+
+def _loaded_tokenizer():
+    """The tokenizer if already loaded; otherwise start loading it in the background
+    and return None so the caller estimates meanwhile."""
+    global _LOADER
+    if _TOKENIZER is None:
+        with _TOKENIZER_LOCK:
+            if _LOADER is None:
+                _LOADER = threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True)
+                _LOADER.start()
+    return _TOKENIZER
+
+def est_tokens(text: str) -> int:
+    return int(len(text) * TOKENS_PER_CHAR) + 1
+
+@lru_cache(maxsize=8192)
+def _count_exact(text: str) -> int:
+    return len(_TOKENIZER.encode(text, add_special_tokens=False).ids)
+
+def count_tokens(text: str) -> int:
+    """Exact count once the tokenizer is loaded, length estimate until then (never cached)."""
+    if not _loaded_tokenizer():
+        return est_tokens(text)
+    return _count_exact(text)
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    tok = load_tokenizer()
+    if not tok:
+        return [est_tokens(t) for t in texts]
+    return [len(e.ids) for e in tok.encode_batch(texts, add_special_tokens=False)]
+
+def chunk_tokens(text: str, metadata: Optional[Dict]) -> int:
+    """Token count stored at ingestion if it was made with the current model, else counted now."""
+    if metadata and metadata.get("token_model") == token_model() and metadata.get("tokens"):
+        return int(metadata["tokens"])
+    return count_tokens(text)
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from importlib import import_module
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_STATE: Dict[str, Any] = {"status": "idle", "started_at": None, "finished_at": None, "steps": {}}
+_LOCK = threading.Lock()
+
+
+def _warm_nlp() -> None:
+    from .nlp import nlp
+    nlp()("Warm-up sentence for the assistant.")
+
+def _warm_embedding() -> None:
+    from .embeddings import get_embeddings
+    embeddings = get_embeddings()
+    # Skip the embedding cache: the point is to get the model loaded in Ollama
+    getattr(embeddings, "inner", embeddings).embed_query("warm up")
+
+def _warm_qa() -> None:
+    # Import the retrieval stack here rather than in the first request
+    import_module("assistant.qa")
+
+def _warm_tokenizer() -> None:
+    from .tokens import load_tokenizer
+    if not load_tokenizer():
+        raise RuntimeError("tokenizer unavailable, token counts are estimated")
+
+def _warm_reranker() -> None:
+    from .rerank import get_reranker
+    reranker = get_reranker()
+    if reranker is not None and not reranker.ready(block=True):
+        raise RuntimeError("reranker model unavailable, combined_rank_score will be used")
+
+def active_courses(limit: int) -> List[int]:
+    """Courses with the most enrollments that have an index on disk."""
+    from django.db.models import Count
+    from courses.models import Course
+    from .stores import course_dir
+
+    ids = Course.objects.annotate(n=Count("enrollment")).order_by("-n", "-id").values_list("id", flat=True)
+    return [cid for cid in ids[:limit * 4] if (course_dir(cid) / "chroma.sqlite3").exists()][:limit]
+
+def _warm_stores() -> None:
+    from .lexical import course_lexical_index
+    from .kg import course_graph
+    from .stores import course_store
+
+    for course_id in active_courses(int(getattr(settings, "ASSISTANT_WARMUP_COURSES", 3))):
+        course_store(course_id)._collection.count()
+        course_lexical_index(course_id)
+        course_graph(course_id, block=True)
+
+STEPS: List[tuple] = [
+    ("nlp", _warm_nlp),
+    ("qa", _warm_qa),
+    ("tokenizer", _warm_tokenizer),
+    ("embedding", _warm_embedding),
+    ("reranker", _warm_reranker),
+    ("stores", _warm_stores),
+]
+
+def _run(steps: List[tuple]) -> None:
+    failed = False
+    for name, fn in steps:
+        start = time.perf_counter()
+        try:
+            fn()
+            result = {"ok": True}
+        except Exception as e:
+            failed = True
+            result = {"ok": False, "error": str(e)}
+            logger.warning("Assistant warm-up step %s failed: %s", name, e)
+        result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        with _LOCK:
+            _STATE["steps"][name] = result
+    with _LOCK:
+        _STATE["status"] = "degraded" if failed else "ready"
+        _STATE["finished_at"] = time.time()
+    logger.info("Assistant warm-up finished: %s", _STATE["steps"])
+
+def start(steps: Optional[List[tuple]] = None) -> bool:
+    """Run the warm-up once per process in a background thread. Returns False if already started."""
+    with _LOCK:
+        if _STATE["status"] != "idle":
+            return False
+        _STATE["status"] = "warming"
+        _STATE["started_at"] = time.time()
+    threading.Thread(target=_run, args=(steps or STEPS,), name="assistant-warmup", daemon=True).start()
+    return True
+
+def status() -> Dict[str, Any]:
+    with _LOCK:
+        return {**_STATE, "steps": dict(_STATE["steps"])}
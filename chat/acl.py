@@ -1,26 +1,157 @@
 # chat/acl.py
-from users.models import Professor, TeachingAssistant, Student
-from courses.models import Enrollment
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, FrozenSet, Iterable, Optional, Tuple
 
-def user_can_access_course_room(user, course) -> bool:
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import F, Value
+from users.models import TeachingAssistant
+from courses.models import Course, Enrollment
+
+# Role codes as in users.models.Person.ROLE_CHOICES
+PROFESSOR, TEACHING_ASSISTANT, STUDENT = "p", "t", "s"
+
+CourseRoles = Dict[int, FrozenSet[str]]
+
+
+def query_course_roles(user_id: int) -> CourseRoles:
+    """{course id: roles} for every course the user teaches, assists or is enrolled in (one UNION query)."""
+    taught = Course.objects.filter(instructor__user_id=user_id).values_list("id", Value(PROFESSOR))
+    assisted = TeachingAssistant.course.through.objects.filter(
+        teachingassistant__user_id=user_id
+    ).values_list(F("course_id"), Value(TEACHING_ASSISTANT))
+    enrolled = Enrollment.objects.filter(student__user_id=user_id).values_list(F("course_id"), Value(STUDENT))
+
+    roles = defaultdict(set)
+    for course_id, role in taught.union(assisted, enrolled, all=True):
+        roles[course_id].add(role)
+    return {course_id: frozenset(r) for course_id, r in roles.items()}
+
+
+class CourseAccessCache:
+    """Per-process cache of each user's course roles with TTL and LRU eviction.
+
+    Concurrent misses for the same user share one query, and expiry times are
+    jittered, so a mass reconnect after a deploy costs at most one query per
+    user instead of one per socket. chat.signals invalidates users whose
+    enrollment, TA assignment or profile changes in the committing process
+    and broadcasts it to the ACL_GROUP listener of every other process (see
+    ensure_invalidation_listener). A process without a running listener
+    (no chat socket opened yet) sees the change after at most the TTL.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60, jitter: float = 0.1):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        # user id -> (roles, expires at)
+        self._entries: "OrderedDict[int, Tuple[CourseRoles, float]]" = OrderedDict()
+        # user id -> event set when the in-flight load finishes
+        self._loading: Dict[int, threading.Event] = {}
+        # bumped on invalidation so a load that raced it is not stored
+        self._generation = 0
+
+    def get(self, user_id: int, loader: Callable[[int], CourseRoles] = query_course_roles) -> CourseRoles:
+        while True:
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    return entry[0]
+                pending = self._loading.get(user_id)
+                if pending is None:
+                    done = self._loading[user_id] = threading.Event()
+                    generation = self._generation
+                    break
+            # Someone else is loading this user: wait for it, then re-check
+            pending.wait(timeout=5)
+
+        try:
+            roles = loader(user_id)
+        finally:
+            with self._lock:
+                del self._loading[user_id]
+            done.set()
+        with self._lock:
+            if generation == self._generation:
+                expires = time.monotonic() + self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+                self._entries[user_id] = (roles, expires)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return roles
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+_CACHE: Optional[CourseAccessCache] = None
+
+def course_access_cache() -> CourseAccessCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = CourseAccessCache(
+            max_entries=int(getattr(settings, "CHAT_ACL_CACHE_SIZE", 10000)),
+            ttl=float(getattr(settings, "CHAT_ACL_CACHE_TTL", 60)),
+        )
+    return _CACHE
+
+# Channel-layer group every process's invalidation listener joins
+ACL_GROUP = "chat_acl"
+
+_LISTENERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
+
+def ensure_invalidation_listener() -> None:
+    """Start this event loop's ACL_GROUP listener if it is not running (call from async code)."""
+    loop = asyncio.get_running_loop()
+    task = _LISTENERS.get(loop)
+    if task is None or task.done():
+        _LISTENERS[loop] = loop.create_task(_listen_for_invalidations())
+
+async def _listen_for_invalidations() -> None:
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    channel = await layer.new_channel("acl.")
+    # Re-join periodically: layers expire group membership (group_expiry)
+    rejoin = float(getattr(layer, "group_expiry", 86400)) / 2
+    while True:
+        await layer.group_add(ACL_GROUP, channel)
+        try:
+            message = await asyncio.wait_for(layer.receive(channel), timeout=rejoin)
+        except asyncio.TimeoutError:
+            continue
+        user_ids = message.get("user_ids") or ()
+        if user_ids:
+            course_access_cache().invalidate(user_ids)
+
+def broadcast_invalidation(user_ids: Iterable[int]) -> None:
+    """Invalidate users in this process now and in every process with a listener (sync code)."""
+    user_ids = list(user_ids)
+    course_access_cache().invalidate(user_ids)
+    layer = get_channel_layer()
+    if layer is not None and user_ids:
+        async_to_sync(layer.group_send)(ACL_GROUP, {"type": "acl.invalidate", "user_ids": user_ids})
+
+def user_course_roles(user) -> CourseRoles:
     if not user.is_authenticated:
-        return False
-
-    # Professor of this course? (support either course.instructor or course.professor)
-    prof = Professor.objects.filter(user=user).first()
-    if prof:
-        if getattr(course, "instructor_id", None) == prof.id:
-            return True
-        if getattr(course, "professor_id", None) == prof.id:
-            return True
-
-    # TA assigned to this course?  (your TA model: course = ManyToManyField(Course))
-    if TeachingAssistant.objects.filter(user=user, course__id=course.id).exists():
-        return True
-
-    # Enrolled student?
-    student = Student.objects.filter(user=user).first()
-    if student and Enrollment.objects.filter(student_id=student.id, course_id=course.id).exists():
-        return True
-
-    return False
+        return {}
+    return course_access_cache().get(user.pk)
+
+def user_can_access_course_room(user, course) -> bool:
+    return getattr(course, "pk", course) in user_course_roles(user)
@@ -0,0 +1,155 @@
+# chat/broker.py
+"""Minimal Redis-protocol (RESP2) pub/sub broker.
+
+A local stand-in for Redis so the production channel layer
+(chat.layers.BatchingRedisPubSubChannelLayer) can fan out across several
+Daphne processes on a dev box or in tests without installing Redis. It
+implements only what the pub/sub layer uses: HELLO (RESP2 or RESP3), PING,
+ECHO, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, SELECT and CLIENT (accepted and
+ignored). Not for production.
+
+Backpressure: PUBLISH waits until every subscriber's socket accepts more
+data (StreamWriter.drain), so a slow subscriber slows its publishers down
+instead of growing the broker's memory. A subscriber whose unsent output
+exceeds `max_output` bytes is disconnected, as Redis does with
+client-output-buffer-limit for pub/sub clients.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def _bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def _array(*items: bytes, kind: bytes = b"*") -> bytes:
+    return kind + b"%d\r\n" % len(items) + b"".join(items)
+
+def _map(pairs: dict, resp3: bool) -> bytes:
+    body = b"".join(k + v for k, v in pairs.items())
+    return (b"%%%d\r\n" % len(pairs) if resp3 else b"*%d\r\n" % (2 * len(pairs))) + body
+
+def _int(n: int) -> bytes:
+    return b":%d\r\n" % n
+
+
+class PubSubBroker:
+    def __init__(self, max_output: int = 32 * 1024 * 1024):
+        self.max_output = max_output
+        # channel -> writers subscribed to it
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        # writers that negotiated RESP3 get pub/sub frames as pushes (">")
+        self.resp3: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self, path: Optional[str] = None, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+        return self._server
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()  # inline command (e.g. from redis-cli / telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        subscribed: Set[bytes] = set()
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                cmd = args[0].upper()
+                push = b">" if writer in self.resp3 else b"*"
+                if cmd == b"PUBLISH":
+                    items = (_bulk(b"message"), _bulk(args[1]), _bulk(args[2]))
+                    targets = [t for t in self.subscribers.get(args[1], ()) if not t.transport.is_closing()]
+                    for target in targets:
+                        target.write(_array(*items, kind=b">" if target in self.resp3 else b"*"))
+                    writer.write(_int(len(targets)))
+                    await self._drain(targets)
+                elif cmd == b"SUBSCRIBE":
+                    for channel in args[1:]:
+                        subscribed.add(channel)
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(_array(_bulk(b"subscribe"), _bulk(channel), _int(len(subscribed)), kind=push))
+                elif cmd == b"UNSUBSCRIBE":
+                    for channel in args[1:] or list(subscribed):
+                        subscribed.discard(channel)
+                        self._drop(channel, writer)
+                        writer.write(_array(_bulk(b"unsubscribe"), _bulk(channel), _int(len(subscribed)), kind=push))
+                elif cmd == b"HELLO":
+                    proto = int(args[1]) if len(args) > 1 else 2
+                    if proto == 3:
+                        self.resp3.add(writer)
+                    else:
+                        self.resp3.discard(writer)
+                    writer.write(_map({_bulk(b"server"): _bulk(b"lms-chat-broker"), _bulk(b"proto"): _int(proto)}, proto == 3))
+                elif cmd == b"PING":
+                    if subscribed and writer not in self.resp3:
+                        writer.write(_array(_bulk(b"pong"), _bulk(b"")))
+                    else:
+                        writer.write(b"+PONG\r\n")
+                elif cmd == b"ECHO":
+                    writer.write(_bulk(args[1]))
+                elif cmd in (b"SELECT", b"CLIENT"):
+                    writer.write(b"+OK\r\n")
+                elif cmd == b"QUIT":
+                    writer.write(b"+OK\r\n")
+                    break
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % args[0])
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            for channel in subscribed:
+                self._drop(channel, writer)
+            self.resp3.discard(writer)
+            self._connections.discard(task)
+            writer.close()
+
+    async def _drain(self, targets: List[asyncio.StreamWriter]) -> None:
+        slow = []
+        for target in targets:
+            if target.transport.get_write_buffer_size() > self.max_output:
+                logger.warning("Disconnecting pub/sub subscriber over the %d byte output limit", self.max_output)
+                target.transport.abort()
+            elif target.transport.get_write_buffer_size():
+                slow.append(target.drain())
+        # A subscriber that went away is cleaned up by its own connection handler
+        await asyncio.gather(*slow, return_exceptions=True)
+
+    def _drop(self, channel: bytes, writer: asyncio.StreamWriter) -> None:
+        subs = self.subscribers.get(channel)
+        if subs is not None:
+            subs.discard(writer)
+            if not subs:
+                del self.subscribers[channel]
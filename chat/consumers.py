@@ -1,72 +1,109 @@
 import json
+from typing import Optional, Tuple
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from courses.models import Course
 from .models import ChatRoom, ChatMessage
-from .acl import user_can_access_course_room
+from .acl import course_access_cache, ensure_invalidation_listener, user_can_access_course_room
+from .services import display_name
+from .writebehind import get_buffer
+
+User = get_user_model()
 
 class PingConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         await self.accept()
         await self.send_json({"ok": True})
 
+def course_group_name(course_id) -> str:
+    return f"course_chat_{course_id}"
+
+def user_group_name(user_id) -> str:
+    """Group every chat socket of a user joins; used to push access/profile changes."""
+    return f"chat_user_{user_id}"
+
 class CourseChatConsumer(AsyncWebsocketConsumer):
+    # Room, ACL decision and sender name are resolved once in connect() and kept
+    # on the consumer; chat.signals pushes "chat.access_changed" to the user's
+    # group when an enrollment, TA assignment or profile changes.
+    room_id = None
+    sender_name = ""
+
     async def connect(self):
         self.course_id = int(self.scope["url_route"]["kwargs"]["course_id"])
-        self.group_name = f"course_chat_{self.course_id}"
+        self.group_name = course_group_name(self.course_id)
         user = self.scope["user"]
         if not user.is_authenticated:
             return await self.close(code=4001)
 
-        course = await sync_to_async(lambda: get_object_or_404(Course, pk=self.course_id))()
-        allowed = await sync_to_async(user_can_access_course_room)(user, course)
-        if not allowed:
+        access = await sync_to_async(self._resolve_access)(user)
+        if access is None:
             return await self.close(code=4003)
+        self.room_id, self.sender_name = access
 
+        ensure_invalidation_listener()
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.channel_layer.group_add(user_group_name(user.pk), self.channel_name)
         await self.accept()
 
     async def disconnect(self, code):
+        await self._leave()
+
+    async def _leave(self):
+        if self.room_id is None:
+            return
+        self.room_id = None
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.channel_layer.group_discard(user_group_name(self.scope["user"].pk), self.channel_name)
 
     async def receive(self, text_data):
+        if self.room_id is None:
+            return
         data = json.loads(text_data or "{}")
         content = (data.get("message") or "").strip()
         if not content:
             return
 
         user = self.scope["user"]
-        room = await sync_to_async(self._get_or_create_room)()
-
-        msg = await sync_to_async(ChatMessage.objects.create)(
-            room=room, sender=user, content=content
-        )
-
-        name = await sync_to_async(self._display_name)(user)
-        out = {
-            "id": msg.id,
-            "sender": name,
-            "content": msg.content,
-            "created_at": msg.created_at.isoformat(),
-        }
+        if getattr(settings, "CHAT_WRITE_BEHIND_MS", 50) > 0:
+            # Broadcast now with a provisional id; "chat.saved" follows with the real one
+            out = get_buffer().add(self.room_id, user.pk, content, self.group_name)
+        else:
+            msg = await sync_to_async(ChatMessage.objects.create)(
+                room_id=self.room_id, sender=user, content=content
+            )
+            out = {"id": msg.id, "content": msg.content, "created_at": msg.created_at.isoformat()}
+
+        out.update(sender=self.sender_name, sender_id=user.pk)
         await self.channel_layer.group_send(self.group_name, {"type": "chat.message", "message": out})
 
-    def _get_or_create_room(self):
-        course = Course.objects.get(pk=self.course_id)
+    async def chat_access_changed(self, event):
+        # The change may have been made on another node: drop this process's
+        # cached ACL too, and reload the user so cached profile relations are not reused
+        user_id = self.scope["user"].pk
+        course_access_cache().invalidate([user_id])
+        access = await sync_to_async(
+            lambda: self._resolve_access(User.objects.filter(pk=user_id).first())
+        )()
+        if access is None:
+            await self._leave()
+            return await self.close(code=4003)
+        self.room_id, self.sender_name = access
+
+    def _resolve_access(self, user) -> Optional[Tuple[int, str]]:
+        """(room id, display name) if `user` may chat in this course, else None."""
+        if user is None:
+            return None
+        course = Course.objects.filter(pk=self.course_id).first()
+        if course is None or not user_can_access_course_room(user, course):
+            return None
         room, _ = ChatRoom.objects.get_or_create(course=course)
-        return room
-
-    def _display_name(self, user):
-        # prefer profile names if present; otherwise fallback to Django’s user fields
-        for rel in ("student", "professor", "teachingassistant"):
-            prof = getattr(user, rel, None)
-            if prof:
-                full = f"{getattr(prof, 'first_name','').strip()} {getattr(prof, 'last_name','').strip()}".strip()
-                if full:
-                    return full
-        full = (getattr(user, "get_full_name", lambda: "")() or "").strip()
-        return full or getattr(user, "username", "User")
+        return room.pk, display_name(user)
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps(event["message"]))
+
+    async def chat_saved(self, event):
+        await self.send(text_data=json.dumps({"type": "saved", "ids": event["ids"]}))
@@ -0,0 +1,80 @@
+# chat/layers.py
+import asyncio
+from typing import Dict, List, Tuple
+
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer, _wrap_close
+
+
+class BatchingPubSubLoopLayer(RedisPubSubLoopLayer):
+    """Pub/sub loop layer that pipelines publishes.
+
+    `send`/`group_send` calls made while a publish to the same shard is in flight
+    (or within `batch_window` seconds) are sent together in one Redis pipeline,
+    so a burst of chat messages costs one round trip per shard instead of one
+    per message. Each caller still waits until its own message is published.
+    """
+
+    def __init__(self, *args, batch_window: float = 0.0, max_batch: int = 256, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        # shard index -> [(channel, payload, future)]
+        self._pending: Dict[int, List[Tuple[str, bytes, asyncio.Future]]] = {}
+        self._flushers: Dict[int, asyncio.Task] = {}
+
+    async def _publish(self, channel: str, message) -> None:
+        index = self._shards.index(self._get_shard(channel))
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(index, []).append((channel, self.channel_layer.serialize(message), fut))
+        if index not in self._flushers:
+            self._flushers[index] = asyncio.ensure_future(self._flush_shard(index))
+        await fut
+
+    async def _flush_shard(self, index: int) -> None:
+        shard = self._shards[index]
+        try:
+            # Let the other publishers of this loop iteration (or window) join the batch
+            await asyncio.sleep(self.batch_window)
+            while self._pending.get(index):
+                batch = self._pending[index][:self.max_batch]
+                del self._pending[index][:len(batch)]
+                try:
+                    async with shard._lock:
+                        shard._ensure_redis()
+                        pipe = shard._redis.pipeline(transaction=False)
+                        for channel, payload, _ in batch:
+                            pipe.publish(channel, payload)
+                        await pipe.execute()
+                except Exception as e:
+                    for *_, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                else:
+                    for *_, fut in batch:
+                        if not fut.done():
+                            fut.set_result(None)
+        finally:
+            del self._flushers[index]
+
+    async def send(self, channel, message):
+        await self._publish(channel, message)
+
+    async def group_send(self, group, message):
+        await self._publish(self._get_group_channel_name(group), message)
+
+
+class BatchingRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+    """RedisPubSubChannelLayer whose publishes are batched (see BatchingPubSubLoopLayer).
+
+    Works against Redis or the in-repo stand-in broker (`manage.py run_chat_broker`).
+    """
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = BatchingPubSubLoopLayer(*self._args, **self._kwargs, channel_layer=self)
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from chat.layers import BatchingRedisPubSubChannelLayer
+from chat.models import ChatMessage
+from chat.routing import websocket_urlpatterns
+from courses.models import Course, Enrollment
+from users.models import Professor, Student
+
+
+def _fixtures(n: int, rooms: int):
+    prof_user = User.objects.create(username="bench-prof")
+    prof = Professor.objects.create(first_name="Bench", last_name="Prof", email="bench-prof@example.com", user=prof_user)
+    courses = [Course.objects.create(name=f"Bench {r}", description="", credits=1, instructor=prof) for r in range(rooms)]
+    users = User.objects.bulk_create([User(username=f"bench-{i}") for i in range(n)])
+    students = Student.objects.bulk_create([
+        Student(first_name="Student", last_name=str(i), email=f"bench-{i}@example.com", index=f"{i:06d}", role="s", user=u)
+        for i, u in enumerate(users)
+    ])
+    today = timezone.now().date()
+    Enrollment.objects.bulk_create([
+        Enrollment(course=courses[i % rooms], student=s, enroll_date=today) for i, s in enumerate(students)
+    ])
+    return [(courses[i % rooms], u) for i, u in enumerate(users)]
+
+
+class Command(BaseCommand):
+    help = "Measure chat messages/sec persisted with N concurrent sockets, write-through vs write-behind (uses a throwaway database)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=500)
+        parser.add_argument("--messages", type=int, default=4, help="Messages sent by each socket.")
+        parser.add_argument("--rooms", type=int, default=1, help="Spread the sockets over this many course rooms (1 = one busy lecture).")
+        parser.add_argument("--interval-ms", type=int, default=50, help="Write-behind flush interval.")
+        parser.add_argument(
+            "--layer", choices=("broker", "configured"), default="broker",
+            help="broker: run the stand-in broker (run_chat_broker) in a subprocess and use the Redis pub/sub layer; "
+                 "configured: use CHANNEL_LAYERS as is (InMemoryChannelLayer slows down with hundreds of channels).",
+        )
+
+    def handle(self, *args, **opts):
+        # A file-backed SQLite test database, so commits pay the real write-lock/fsync cost
+        test_settings = settings.DATABASES["default"].setdefault("TEST", {})
+        fd, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        test_settings["NAME"] = path
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        broker = None
+        try:
+            if opts["layer"] == "broker":
+                sock = path + ".sock"
+                broker = subprocess.Popen(
+                    [sys.executable, "-u", "manage.py", "run_chat_broker", "--socket", sock],
+                    cwd=settings.BASE_DIR, stdout=subprocess.PIPE,
+                )
+                broker.stdout.readline()  # "listening on ..."
+                channel_layers.set("default", BatchingRedisPubSubChannelLayer(hosts=[f"unix://{sock}"], batch_window=0.002))
+            members = _fixtures(opts["sockets"], max(1, opts["rooms"]))
+            self.stdout.write(f"sockets: {opts['sockets']} in {opts['rooms']} room(s), messages per socket: {opts['messages']}")
+            for label, interval in (("write-through", 0), ("write-behind", opts["interval_ms"])):
+                with override_settings(CHAT_WRITE_BEHIND_MS=interval):
+                    rate = asyncio.run(self._run(members, opts["messages"]))
+                self.stdout.write(f"{label:14s} {rate:10.0f} msg/s")
+        finally:
+            if broker is not None:
+                broker.terminate()
+                broker.wait()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            for leftover in (path, path + ".sock"):
+                if os.path.exists(leftover):
+                    os.unlink(leftover)
+
+    async def _run(self, members, per_socket: int) -> float:
+        app = URLRouter(websocket_urlpatterns)
+
+        socks = []
+        for course, user in members:
+            comm = WebsocketCommunicator(app, f"/ws/courses/{course.pk}/chat/")
+            comm.scope["user"] = user
+            socks.append(comm)
+        connected = await asyncio.gather(*(c.connect(timeout=30) for c in socks))
+        rejected = sum(not ok for ok, _ in connected)
+        if rejected:
+            raise CommandError(f"{rejected} of {len(socks)} sockets were rejected")
+
+        count = sync_to_async(ChatMessage.objects.count)
+        before = await count()
+        expected = before + per_socket * len(socks)
+
+        start = time.perf_counter()
+        for i in range(per_socket):
+            await asyncio.gather(*(c.send_to(text_data=json.dumps({"message": f"message {i}"})) for c in socks))
+        while await count() < expected:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+
+        await asyncio.gather(*(c.disconnect() for c in socks))
+        return (expected - before) / elapsed
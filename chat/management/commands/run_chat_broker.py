@@ -0,0 +1,26 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.broker import PubSubBroker
+
+
+class Command(BaseCommand):
+    help = "Run the local Redis-compatible pub/sub broker used as a stand-in for Redis by the chat channel layer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default="", help="Listen on this Unix socket (CHAT_REDIS_URL=unix://<path>).")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=6379, help="TCP port when --socket is not given (CHAT_REDIS_URL=redis://<host>:<port>).")
+        parser.add_argument("--max-output-mb", type=int, default=32, help="Disconnect subscribers with more unsent output than this.")
+
+    def handle(self, *args, **opts):
+        asyncio.run(self._serve(opts))
+
+    async def _serve(self, opts):
+        broker = PubSubBroker(max_output=opts["max_output_mb"] * 1024 * 1024)
+        server = await broker.start(path=opts["socket"] or None, host=opts["host"], port=opts["port"])
+        where = opts["socket"] or f"{opts['host']}:{opts['port']}"
+        self.stdout.write(f"Chat broker listening on {where}")
+        async with server:
+            await server.serve_forever()
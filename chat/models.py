@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class ChatRoom(models.Model):
     course = models.OneToOneField(
@@ -14,10 +15,16 @@ class ChatMessage(models.Model):
     room   = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="messages")
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="chat_messages")
     content = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: that would overwrite the send time chat.writebehind sets
+    # with the time of the bulk_create that flushes it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # Keyset pagination of a room's history (chat.services.message_page)
+            models.Index(fields=["room", "created_at", "id"], name="chat_msg_room_created_id"),
+        ]
 
 
     def __str__(self):
@@ -1,7 +1,11 @@
 # chat/services.py
-from typing import List, Optional
+import base64
+import binascii
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from django.utils import timezone
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.db.models import Q
 from .models import ChatRoom, ChatMessage, ChatReadState
 
@@ -86,3 +90,56 @@ def summarize_unread(room, user, limit: int = 100, mark_as_read: bool = True) ->
 
     print(summary)
     return summary or "No unread messages."
+
+# --- Display names -----------------------------------------------------------
+def display_name(user) -> str:
+    # prefer profile names if present; otherwise fallback to Django’s user fields
+    for rel in ("student", "professor", "teachingassistant"):
+        prof = getattr(user, rel, None)
+        if prof:
+            full = f"{getattr(prof, 'first_name','').strip()} {getattr(prof, 'last_name','').strip()}".strip()
+            if full:
+                return full
+    full = (getattr(user, "get_full_name", lambda: "")() or "").strip()
+    return full or getattr(user, "username", "User")
+
+def display_names(user_ids) -> Dict[int, str]:
+    """display_name() for many users with one query (profiles joined in)."""
+    users = get_user_model().objects.filter(pk__in=set(user_ids)).select_related(
+        "student", "professor", "teachingassistant"
+    )
+    return {u.pk: display_name(u) for u in users}
+
+# --- History pagination --------------------------------------------------------
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor(); raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+def message_page(room_id: int, before: Optional[str] = None, limit: int = 50) -> Tuple[List[tuple], Optional[str]]:
+    """One page of a room's history, newest first, older than the `before` cursor.
+
+    Returns ([(id, sender_id, content, created_at)], cursor for the next older
+    page or None). Keyset pagination on (created_at, id), served by the
+    (room, created_at, id) index, so every page costs the same regardless of depth.
+    """
+    qs = ChatMessage.objects.filter(room_id=room_id)
+    if before:
+        created_at, message_id = decode_cursor(before)
+        # The redundant created_at <= bound lets the index seek instead of scan
+        qs = qs.filter(created_at__lte=created_at).filter(Q(created_at__lt=created_at) | Q(id__lt=message_id))
+    rows = list(
+        qs.order_by("-created_at", "-id").values_list("id", "sender_id", "content", "created_at")[:limit + 1]
+    )
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][3], rows[-1][0])
@@ -1,9 +1,83 @@
-from django.db.models.signals import post_save
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
-from courses.models import Course
+from courses.models import Course, Enrollment
+from users.models import Professor, Student, TeachingAssistant
+from .consumers import user_group_name
+from .acl import broadcast_invalidation
 from .models import ChatRoom
 
+logger = logging.getLogger(__name__)
+
+@receiver(pre_save, sender=Course)
+def remember_instructor_change(sender, instance, update_fields=None, **kwargs):
+    if not instance.pk or (update_fields is not None and "instructor" not in update_fields):
+        return
+    old = Course.objects.filter(pk=instance.pk).values_list("instructor_id", flat=True).first()
+    if old != instance.instructor_id:
+        instance._old_instructor_id = old
+
 @receiver(post_save, sender=Course)
 def ensure_chat_room(sender, instance, created, **kwargs):
     if created:
         ChatRoom.objects.get_or_create(course=instance)
+        notify_access_changed(Professor.objects.filter(pk=instance.instructor_id).values_list("user_id", flat=True))
+    elif hasattr(instance, "_old_instructor_id"):
+        # Only the previous and the new instructor gain or lose access
+        professor_ids = [instance.__dict__.pop("_old_instructor_id"), instance.instructor_id]
+        notify_access_changed(Professor.objects.filter(pk__in=professor_ids).values_list("user_id", flat=True))
+
+
+def notify_access_changed(user_ids) -> None:
+    """After commit, drop the users' cached course access and tell their open chat sockets to re-resolve it."""
+    user_ids = [uid for uid in user_ids if uid is not None]
+    if not user_ids:
+        return
+
+    def send():
+        layer = get_channel_layer()
+        try:
+            broadcast_invalidation(user_ids)
+            if layer is None:
+                return
+            for uid in user_ids:
+                async_to_sync(layer.group_send)(user_group_name(uid), {"type": "chat.access_changed"})
+        except Exception:
+            logger.exception("Could not notify chat sockets of access change")
+
+    transaction.on_commit(send)
+
+def _student_user_ids(student_ids):
+    return Student.objects.filter(pk__in=student_ids).values_list("user_id", flat=True)
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def enrollment_changed(sender, instance, **kwargs):
+    notify_access_changed(_student_user_ids([instance.student_id]))
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Professor)
+@receiver(post_save, sender=TeachingAssistant)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Professor)
+@receiver(post_delete, sender=TeachingAssistant)
+def profile_changed(sender, instance, created=False, **kwargs):
+    # Names and roles feed the cached display name / ACL decision
+    if not created:
+        notify_access_changed([instance.user_id])
+
+@receiver(m2m_changed, sender=TeachingAssistant.course.through)
+def ta_courses_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        user_ids = [instance.user_id]
+    elif action == "pre_clear":
+        user_ids = instance.teaching_assistants.values_list("user_id", flat=True)
+    else:
+        user_ids = TeachingAssistant.objects.filter(pk__in=pk_set).values_list("user_id", flat=True)
+    notify_access_changed(user_ids)
@@ -1,3 +1,252 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from courses.models import Course, Enrollment
+from users.models import Professor, Student, TeachingAssistant
+
+from . import signals
+from .acl import (
+    PROFESSOR, STUDENT, TEACHING_ASSISTANT, CourseAccessCache, broadcast_invalidation, course_access_cache,
+    ensure_invalidation_listener, query_course_roles,
+)
+from .broker import PubSubBroker
+from .layers import BatchingRedisPubSubChannelLayer
+from .models import ChatMessage, ChatRoom
+from .services import decode_cursor, encode_cursor, message_page
+from .writebehind import MessageBuffer
+
+
+class BatchingLayerBrokerTests(SimpleTestCase):
+    """BatchingPubSubLoopLayer end to end through the stand-in broker (redis-py speaks RESP3 to it)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.socket = os.path.join(tmp.name, "broker.sock")
+
+    async def _with_layer(self, test):
+        broker = PubSubBroker()
+        await broker.start(path=self.socket)
+        layer = BatchingRedisPubSubChannelLayer(hosts=[f"unix://{self.socket}"], batch_window=0.002)
+        try:
+            await asyncio.wait_for(test(layer), timeout=10)
+        finally:
+            await layer.flush()
+            await broker.close()
+
+    async def test_group_round_trip(self):
+        async def test(layer):
+            channels = [await layer.new_channel() for _ in range(3)]
+            for channel in channels:
+                await layer.group_add("course_1", channel)
+            await layer.group_discard("course_1", channels[2])
+
+            await layer.group_send("course_1", {"type": "chat.message", "text": "hello"})
+            for channel in channels[:2]:
+                self.assertEqual(await layer.receive(channel), {"type": "chat.message", "text": "hello"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channels[2]), timeout=0.2)
+
+        await self._with_layer(test)
+
+    async def test_concurrent_sends_are_batched_and_all_delivered(self):
+        async def test(layer):
+            channel = await layer.new_channel()
+            await layer.group_add("course_1", channel)
+            await asyncio.gather(*(layer.group_send("course_1", {"type": "chat.message", "n": i}) for i in range(50)))
+            received = [await layer.receive(channel) for _ in range(50)]
+            self.assertEqual(sorted(m["n"] for m in received), list(range(50)))
+
+        await self._with_layer(test)
+
+    async def test_slow_subscriber_over_output_limit_is_disconnected(self):
+        broker = PubSubBroker(max_output=1024)
+        await broker.start(path=self.socket)
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket)
+            writer.write(b"SUBSCRIBE room\r\n")
+            await reader.readline()
+            # Never read again: stop the socket so the broker's buffer fills up
+            writer.transport.pause_reading()
+            _, pub = await asyncio.open_unix_connection(self.socket)
+            payload = b"x" * 8 * 1024
+            for _ in range(512):
+                pub.write(b"PUBLISH room " + payload + b"\r\n")
+            await pub.drain()
+            for _ in range(100):
+                if not broker.subscribers:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(broker.subscribers, {})
+            pub.close()
+            writer.close()
+        finally:
+            await broker.close()
+
+
+class CourseAccessSignalTests(TestCase):
+    def setUp(self):
+        self.prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        self.other = Professor.objects.create(first_name="Alan", last_name="T", email="alan@example.com")
+        self.course = Course.objects.create(name="Algebra", description="", credits=5, instructor=self.prof)
+
+    def test_saving_course_without_instructor_change_notifies_nobody(self):
+        with mock.patch.object(signals, "notify_access_changed") as notify:
+            self.course.name = "Linear algebra"
+            self.course.save()
+        notify.assert_not_called()
+
+    def test_instructor_change_notifies_old_and_new_instructor(self):
+        with mock.patch.object(signals, "notify_access_changed") as notify:
+            self.course.instructor = self.other
+            self.course.save()
+        notify.assert_called_once()
+        self.assertEqual(sorted(notify.call_args.args[0]), sorted([self.prof.user_id, self.other.user_id]))
+
+
+class MessageBufferTests(TestCase):
+    def setUp(self):
+        prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        course = Course.objects.create(name="Algebra", description="", credits=5, instructor=prof)
+        self.room_id = ChatRoom.objects.get(course=course).pk
+        self.user_id = prof.user_id
+        # Flushed explicitly by the tests
+        self.buffer = MessageBuffer(interval_ms=60_000)
+
+    async def test_flush_keeps_send_time(self):
+        out = self.buffer.add(self.room_id, self.user_id, "hello", "course_chat_1")
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.buffer.flush(), 1)
+        msg = await ChatMessage.objects.aget(room_id=self.room_id)
+        self.assertEqual(msg.created_at.isoformat(), out["created_at"])
+
+    async def test_failed_flush_requeues_batch(self):
+        self.buffer.add(self.room_id, self.user_id, "hello", "course_chat_1")
+        with mock.patch.object(ChatMessage.objects, "bulk_create", side_effect=RuntimeError("db down")), \
+                self.assertLogs("chat.writebehind", "ERROR"):
+            self.assertEqual(await self.buffer.flush(), 0)
+        self.assertEqual((len(self.buffer._pending), self.buffer._inflight), (1, []))
+        self.assertEqual(await self.buffer.flush(), 1)
+
+    def test_drain_saves_batches_still_in_flight(self):
+        msg = ChatMessage(room_id=self.room_id, sender_id=self.user_id, content="mid-flush")
+        self.buffer._inflight.append([("p-1", msg, "course_chat_1")])
+        self.assertEqual(self.buffer.drain(), 1)
+        self.assertTrue(ChatMessage.objects.filter(content="mid-flush").exists())
+
+
+class CourseRolesTests(TestCase):
+    def setUp(self):
+        self.prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        self.ta = TeachingAssistant.objects.create(first_name="Tim", last_name="A", email="tim@example.com")
+        self.student = Student.objects.create(first_name="Sam", last_name="S", email="sam@example.com")
+        self.algebra, self.logic = (
+            Course.objects.create(name=name, description="", credits=5, instructor=self.prof)
+            for name in ("Algebra", "Logic")
+        )
+        self.ta.course.add(self.algebra)
+        Enrollment.objects.create(course=self.logic, student=self.student, enroll_date=timezone.now().date())
+
+    def test_roles_per_course_in_one_query(self):
+        with self.assertNumQueries(1):
+            roles = query_course_roles(self.prof.user_id)
+        self.assertEqual(roles, {self.algebra.pk: {PROFESSOR}, self.logic.pk: {PROFESSOR}})
+        self.assertEqual(query_course_roles(self.ta.user_id), {self.algebra.pk: {TEACHING_ASSISTANT}})
+        self.assertEqual(query_course_roles(self.student.user_id), {self.logic.pk: {STUDENT}})
+
+    def test_enrollment_change_invalidates_cached_roles(self):
+        cache = course_access_cache()
+        cache.clear()
+        self.assertEqual(cache.get(self.student.user_id), {self.logic.pk: {STUDENT}})
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.create(course=self.algebra, student=self.student, enroll_date=timezone.now().date())
+        self.assertEqual(cache.get(self.student.user_id), {self.logic.pk: {STUDENT}, self.algebra.pk: {STUDENT}})
+
+
+class CourseAccessCacheTests(SimpleTestCase):
+    def test_hits_until_invalidated(self):
+        cache, calls = CourseAccessCache(), []
+        loader = lambda uid: calls.append(uid) or {1: frozenset({STUDENT})}
+        cache.get(7, loader)
+        cache.get(7, loader)
+        self.assertEqual(calls, [7])
+        cache.invalidate([7])
+        cache.get(7, loader)
+        self.assertEqual(calls, [7, 7])
+
+    def test_load_racing_an_invalidation_is_not_stored(self):
+        cache = CourseAccessCache()
+
+        def loader(uid):
+            cache.invalidate([uid])  # e.g. an enrollment committed mid-query
+            return {}
+
+        cache.get(7, loader)
+        self.assertNotIn(7, cache._entries)
+
+    async def test_broadcast_reaches_other_processes_listener(self):
+        cache = course_access_cache()
+        ensure_invalidation_listener()
+        await asyncio.sleep(0.01)  # let the listener join the group
+        cache._entries[7] = ({1: frozenset({STUDENT})}, float("inf"))
+        # What another process's listener receives
+        await get_channel_layer().group_send("chat_acl", {"type": "acl.invalidate", "user_ids": [7]})
+        for _ in range(50):
+            if 7 not in cache._entries:
+                break
+            await asyncio.sleep(0.01)
+        self.assertNotIn(7, cache._entries)
+
+        cache._entries[8] = ({}, float("inf"))
+        await sync_to_async(broadcast_invalidation)([8])
+        self.assertNotIn(8, cache._entries)
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.prof = Professor.objects.create(first_name="Ada", last_name="L", email="ada@example.com")
+        self.course = Course.objects.create(name="Algebra", description="", credits=5, instructor=self.prof)
+        self.room = ChatRoom.objects.get(course=self.course)
+        start = timezone.now()
+        # Pairs of messages share a timestamp, so pages must break ties on id
+        self.messages = ChatMessage.objects.bulk_create([
+            ChatMessage(room=self.room, sender_id=self.prof.user_id, content=f"m{i}", created_at=start + timedelta(seconds=i // 2))
+            for i in range(23)
+        ])
+
+    def test_cursor_round_trip(self):
+        msg = self.messages[5]
+        self.assertEqual(decode_cursor(encode_cursor(msg.created_at, msg.pk)), (msg.created_at, msg.pk))
+        for bad in ("", "not base64!", encode_cursor(msg.created_at, msg.pk)[:-3]):
+            with self.assertRaises(ValueError):
+                decode_cursor(bad)
+
+    def test_page_walk_visits_every_message_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = message_page(self.room.pk, before=cursor, limit=5)
+            seen.extend(row[0] for row in rows)
+            if cursor is None:
+                break
+        expected = [m.pk for m in sorted(self.messages, key=lambda m: (m.created_at, m.pk), reverse=True)]
+        self.assertEqual(seen, expected)
+
+    def test_history_endpoint(self):
+        self.client.force_login(self.prof.user)
+        url = reverse("course_chat_history", args=[self.course.pk])
+        first = self.client.get(url, {"limit": 20}).json()
+        self.assertEqual(len(first["messages"]), 20)
+        rest = self.client.get(url, {"limit": 20, "before": first["next"]}).json()
+        self.assertEqual([m[2] for m in rest["messages"]], ["m2", "m1", "m0"])
+        self.assertIsNone(rest["next"])
+        self.assertEqual(set(rest["senders"]), {str(self.prof.user_id)})
+        self.assertEqual(self.client.get(url, {"before": "garbage"}).status_code, 400)
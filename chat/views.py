@@ -1,14 +1,15 @@
 # chat/views.py
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.http import HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.decorators.http import require_http_methods
 
-from courses.models import Course, Enrollment
+from courses.models import Course
 from .models import ChatRoom
-from .acl import user_can_access_course_room
-from .services import summarize_unread
+from .acl import user_course_roles
+from .services import display_names, encode_cursor, message_page, summarize_unread
+
+HISTORY_PAGE = 50
 
 
 @login_required
@@ -16,34 +17,55 @@ def course_chat(request, course_id):
     course = get_object_or_404(Course, pk=course_id)
     user = request.user
 
-    is_prof = Course.objects.filter(instructor__user=user).exists()
-    is_ta = Course.objects.filter(teaching_assistants__user=user).exists()
-    is_student = Enrollment.objects.filter(student__user=user).exists()
-
-    if not (is_prof | is_ta | is_student):
+    # Courses the user is involved in (any role), from the cached ACL
+    roles = user_course_roles(user)
+    if not roles:
         return HttpResponseForbidden("You do not have access to this course.")
-
-    # Build list of courses the user is involved in (any role)
-    courses = Course.objects.filter(
-        Q(instructor__user=user) |
-        Q(teaching_assistants__user=user) |  # or Q(teaching_assistants=user) if M2M to User
-        Q(enrollment__student__user=user)
-    ).distinct().order_by("name")
-
-    # Use request.user here
-    if not user_can_access_course_room(user, course):
+    if course.pk not in roles:
         return HttpResponseForbidden("Not allowed.")
 
+    courses = Course.objects.filter(pk__in=roles).order_by("name")
+
     room, _ = ChatRoom.objects.get_or_create(course=course)
-    messages = room.messages.select_related("sender").order_by("-created_at")[:50]
-    messages = list(messages)[::-1]
+    messages = list(room.messages.select_related("sender").order_by("-created_at", "-id")[:HISTORY_PAGE + 1])
+    # Older messages are fetched by course_chat_history as the user scrolls up
+    history_cursor = encode_cursor(messages[-2].created_at, messages[-2].id) if len(messages) > HISTORY_PAGE else ""
+    messages = messages[:HISTORY_PAGE][::-1]
     context = {
         "course": course,
         "messages": messages,
         "courses": courses,
+        "history_cursor": history_cursor,
     }
     return render(request, "forum.html", context=context)
 
+@require_http_methods(["GET"])
+@login_required
+def course_chat_history(request, course_id):
+    """Older messages of a course chat, newest first, one keyset page at a time.
+
+    ?before=<cursor from the previous page>&limit=<1..100>. Returns
+    {"messages": [[id, sender_id, content, created_at], ...], "senders": {id: name}, "next": cursor|null}.
+    """
+    if course_id not in user_course_roles(request.user):
+        return JsonResponse({"error": "Not allowed."}, status=403)
+    room_id = ChatRoom.objects.filter(course_id=course_id).values_list("id", flat=True).first()
+    if room_id is None:
+        return JsonResponse({"messages": [], "senders": {}, "next": None})
+
+    try:
+        limit = min(max(int(request.GET.get("limit", HISTORY_PAGE)), 1), 100)
+        rows, cursor = message_page(room_id, before=request.GET.get("before") or None, limit=limit)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    names = display_names(sender_id for _, sender_id, _, _ in rows)
+    return JsonResponse({
+        "messages": [[mid, sender_id, content, created_at.isoformat()] for mid, sender_id, content, created_at in rows],
+        "senders": names,
+        "next": cursor,
+    })
+
 @require_http_methods(["POST"])
 @login_required
 def unread_summary(request, room_id: int):
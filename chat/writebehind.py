@@ -0,0 +1,208 @@
+# chat/writebehind.py
+"""Write-behind buffer for chat messages.
+
+Consumers broadcast a message right away with a provisional id ("p-…") and hand
+it to the buffer, which saves queued messages with one bulk_create every
+CHAT_WRITE_BEHIND_MS milliseconds or CHAT_WRITE_BEHIND_MAX messages, whichever
+comes first. Once saved, each room gets a "chat.saved" event mapping the
+provisional ids to the real ones.
+
+Durability is at-least-once across graceful shutdowns: a batch stays in the
+buffer until its bulk_create has committed, a failed flush is retried, and
+whatever is left when the server stops is saved by a shutdown hook (Daphne's
+reactor "before shutdown" trigger, with atexit as the fallback). A message
+can be written twice but is not dropped.
+"""
+import atexit
+import asyncio
+import logging
+import sys
+import threading
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed flushes before falling back to row-by-row inserts
+MAX_RETRIES = 5
+
+
+class MessageBuffer:
+    def __init__(self, interval_ms: Optional[float] = None, max_batch: Optional[int] = None):
+        self.interval = (interval_ms if interval_ms is not None else getattr(settings, "CHAT_WRITE_BEHIND_MS", 50)) / 1000
+        self.max_batch = max_batch or int(getattr(settings, "CHAT_WRITE_BEHIND_MAX", 200))
+        # (provisional id, unsaved ChatMessage, course group to notify)
+        self._pending: List[Tuple[str, ChatMessage, str]] = []
+        # Batches handed to bulk_create and not yet committed
+        self._inflight: List[List[Tuple[str, ChatMessage, str]]] = []
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+
+    def add(self, room_id: int, sender_id: int, content: str, group: str) -> Dict[str, Any]:
+        """Queue a message; returns the provisional fields to broadcast now."""
+        msg = ChatMessage(room_id=room_id, sender_id=sender_id, content=content, created_at=timezone.now())
+        provisional = f"p-{uuid.uuid4().hex[:16]}"
+        with self._lock:
+            self._pending.append((provisional, msg, group))
+            size = len(self._pending)
+        self._ensure_flusher()
+        if size >= self.max_batch:
+            self._wake.set()
+        return {"id": provisional, "content": content, "created_at": msg.created_at.isoformat()}
+
+    def _ensure_flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            with self._lock:
+                empty = not self._pending
+            if empty:
+                return  # restarted by the next add()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Save everything queued so far and broadcast the id mapping. Returns rows saved."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            self._inflight.append(batch)
+        try:
+            saved = await sync_to_async(self._save)(batch)
+        except Exception:
+            logger.exception("Chat write-behind flush of %d message(s) failed; will retry", len(batch))
+            with self._lock:
+                self._done(batch)
+                self._pending[:0] = batch
+            return 0
+
+        layer = get_channel_layer()
+        if layer is not None:
+            by_group = defaultdict(list)
+            for provisional, msg, group in saved:
+                by_group[group].append({"provisional_id": provisional, "id": msg.pk, "created_at": msg.created_at.isoformat()})
+            try:
+                for group, ids in by_group.items():
+                    await layer.group_send(group, {"type": "chat.saved", "ids": ids})
+            except Exception:
+                logger.exception("Could not broadcast saved chat message ids")
+        return len(saved)
+
+    def _done(self, batch: List[Tuple[str, ChatMessage, str]]) -> None:
+        # Caller holds self._lock
+        self._inflight = [b for b in self._inflight if b is not batch]
+
+    def _save(self, batch: List[Tuple[str, ChatMessage, str]]) -> List[Tuple[str, ChatMessage, str]]:
+        close_old_connections()
+        try:
+            ChatMessage.objects.bulk_create([msg for _, msg, _ in batch])
+            with self._lock:
+                self._done(batch)
+                self._failures = 0
+            return batch
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                give_up = self._failures >= MAX_RETRIES
+                if give_up:
+                    self._failures = 0
+            if not give_up:
+                raise
+        # Keep failing: save what can be saved (e.g. skip messages for a deleted room)
+        saved = []
+        for item in batch:
+            try:
+                item[1].save(force_insert=True)
+                saved.append(item)
+            except Exception:
+                logger.exception("Dropping chat message %s after %d failed flushes", item[0], MAX_RETRIES)
+        with self._lock:
+            self._done(batch)
+        return saved
+
+    def drain(self) -> int:
+        """Synchronously save whatever is queued or was mid-flush (shutdown path)."""
+        with self._lock:
+            batch = [item for b in self._inflight for item in b] + self._pending
+            self._inflight, self._pending = [], []
+        if batch:
+            ChatMessage.objects.bulk_create([msg for _, msg, _ in batch])
+        return len(batch)
+
+
+_buffer: Optional[MessageBuffer] = None
+_buffer_lock = threading.Lock()
+_shutdown_registered = False
+
+def get_buffer() -> MessageBuffer:
+    global _buffer, _shutdown_registered
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = MessageBuffer()
+        if not _shutdown_registered:
+            _shutdown_registered = True
+            _register_shutdown()
+        return _buffer
+
+def _register_shutdown() -> None:
+    atexit.register(_drain_at_exit)
+    # Under Daphne, flush while its event loop is still running so the rooms
+    # also get their "chat.saved" ids; atexit only catches what is left after that
+    if "twisted.internet.reactor" in sys.modules:
+        from twisted.internet import defer, reactor
+        reactor.addSystemEventTrigger(
+            "before", "shutdown", lambda: defer.Deferred.fromFuture(asyncio.ensure_future(_flush_at_shutdown()))
+        )
+
+async def _flush_at_shutdown() -> None:
+    buffer = _buffer
+    if buffer is None:
+        return
+    try:
+        n = await buffer.flush()
+        if n:
+            logger.info("Saved %d buffered chat message(s) at shutdown", n)
+    except Exception:
+        logger.exception("Could not save buffered chat messages at shutdown")
+
+def _drain_at_exit() -> None:
+    if _buffer is None:
+        return
+    try:
+        n = _buffer.drain()
+        if n:
+            logger.info("Saved %d buffered chat message(s) at shutdown", n)
+    except Exception:
+        logger.exception("Could not save buffered chat messages at shutdown")
+
+@receiver(setting_changed)
+def _reset_buffer(setting, **kwargs):
+    # Pick up CHAT_WRITE_BEHIND_* changes (override_settings in tests and bench_chat)
+    global _buffer
+    if setting in ("CHAT_WRITE_BEHIND_MS", "CHAT_WRITE_BEHIND_MAX"):
+        with _buffer_lock:
+            if _buffer is not None:
+                _buffer.drain()
+            _buffer = None